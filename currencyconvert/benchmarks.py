@@ -0,0 +1,173 @@
+"""Benchmarks for CurrencyConvert.
+
+Drives the real ``cconv`` command with a fake context against a local fixture provider, so
+the numbers cover parsing, the cache, refresh coalescing and formatting without any network.
+Run with ``python -m currencyconvert.benchmarks`` from the repository root, in an environment
+with Red installed.
+"""
+import asyncio
+import json
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+from redbot.core import data_manager
+
+from .matcher import find_amounts
+from .providers import FileRateProvider
+
+KNOWN_CODES = frozenset(["AUD", "CAD", "CHF", "EUR", "GBP", "JPY", "NZD", "USD"])
+
+PLAIN_MESSAGES = [
+    "lol",
+    "anyone up for a raid tonight?",
+    "I think the new patch broke something with the healer rotation, can someone check",
+    "https://example.com/some/long/link/without/numbers",
+    "gg everyone, that was a close one " * 8,
+]
+
+NUMERIC_MESSAGES = [
+    "meet at 9 tonight",
+    "patch 1.2.3 is out",
+    "we need 5 more people for the 20 man",
+]
+
+PRICE_MESSAGES = [
+    "$120 USD",
+    "it's 45€ on the store page",
+    "C$30 or 25 USD, whichever is cheaper",
+]
+
+FIXTURE_CODES = [
+    "AUD", "BRL", "CAD", "CHF", "CNY", "CZK", "DKK", "EUR", "GBP", "HKD", "HUF", "IDR",
+    "ILS", "INR", "JPY", "KRW", "MXN", "MYR", "NOK", "NZD", "PHP", "PLN", "RON", "SEK",
+    "SGD", "THB", "TRY", "USD", "ZAR",
+]
+
+
+class SlowFixtureProvider(FileRateProvider):
+    """A fixture provider with simulated network latency that counts its calls."""
+
+    def __init__(self, path, latency):
+        super().__init__(path)
+        self.latency = latency
+        self.calls = 0
+
+    async def fetch_rates(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return await super().fetch_rates()
+
+
+class FakeContext:
+    """Just enough of a commands.Context for cconv to run against."""
+
+    clean_prefix = "!"
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+
+def use_temp_data_path(path):
+    """Point Red's data manager at a scratch directory, as Red's own test fixtures do."""
+    data_manager.basic_config = {**data_manager.basic_config_default, "DATA_PATH": str(path), "STORAGE_TYPE": "JSON"}
+
+
+def write_fixture(path):
+    rng = np.random.default_rng(0)
+    rates = {code: float(rng.uniform(0.1, 150)) for code in FIXTURE_CODES}
+    rates["USD"] = 1.0
+    path.write_text(json.dumps({"base_code": "USD", "rates": rates, "time_last_update_unix": int(time.time())}))
+
+
+def summarize(label, latencies, upstream_calls):
+    latencies = np.asarray(latencies) * 1e3
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"  {label:<28} n={len(latencies):<6} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms  upstream calls {upstream_calls}")
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def bench_cconv(workdir, latency=0.05):
+    from .currencyconvert import CurrencyConvert
+
+    fixture = workdir / "rates.fixture.json"
+    write_fixture(fixture)
+    cog = CurrencyConvert(bot=None)
+    cog.rates.provider = provider = SlowFixtureProvider(fixture, latency)
+    ctx = FakeContext()
+    cconv = CurrencyConvert.cconv.callback
+
+    async def run(*query):
+        return await timed(cconv(cog, ctx, *query))
+
+    print(f"cconv latency (fixture provider with {latency * 1e3:.0f} ms simulated latency)")
+
+    latencies, calls = [], provider.calls
+    for _ in range(20):
+        cog.rates.snapshot = None
+        latencies.append(await run("USD", "CAD", "100"))
+    summarize("cold lookup", latencies, provider.calls - calls)
+
+    calls = provider.calls
+    latencies = [await run("USD", "CAD", "100") for _ in range(5000)]
+    summarize("cached lookup", latencies, provider.calls - calls)
+
+    calls = provider.calls
+    targets = FIXTURE_CODES[:10]
+    latencies = [await run("100", "250", "500", "USD", "to", *targets) for _ in range(1000)]
+    summarize("batch 3 amounts x 10 targets", latencies, provider.calls - calls)
+
+    calls = provider.calls
+    latencies = [await run("EUR", "*") for _ in range(1000)]
+    summarize("batch EUR *", latencies, provider.calls - calls)
+
+    cog.rates.snapshot = None
+    calls = provider.calls
+    latencies = await asyncio.gather(*(run("USD", "CAD", "100") for _ in range(1000)))
+    summarize("burst x1000, empty cache", latencies, provider.calls - calls)
+
+    cog.rates.snapshot.fetched_at -= cog.rates.ttl + 1
+    calls = provider.calls
+    latencies = await asyncio.gather(*(run("USD", "CAD", "100") for _ in range(1000)))
+    summarize("burst x1000, stale cache", latencies, provider.calls - calls)
+    if cog.rates._inflight is not None:
+        await cog.rates._inflight
+
+    await cog.cog_unload()
+
+
+def bench_matcher(messages, number=20000):
+    per_call = []
+    for content in messages:
+        seconds = timeit.timeit(lambda: find_amounts(content, KNOWN_CODES), number=number)
+        per_call.append(seconds / number * 1e6)
+    return sum(per_call) / len(per_call), max(per_call)
+
+
+def main():
+    print("Inline matcher overhead per message (microseconds)")
+    for label, messages in (
+        ("no digits", PLAIN_MESSAGES),
+        ("digits, no price", NUMERIC_MESSAGES),
+        ("prices", PRICE_MESSAGES),
+    ):
+        mean, worst = bench_matcher(messages)
+        print(f"  {label:<18} mean {mean:6.2f}  worst {worst:6.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_temp_data_path(tmp)
+        asyncio.run(bench_cconv(Path(tmp)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,414 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
 import discord
-from redbot.core import commands
-import requests
+import numpy as np
+from redbot.core import commands, Config
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box, humanize_timedelta, pagify
+from redbot.core.utils.menus import DEFAULT_CONTROLS, menu
+
+from .history import RateHistory
+from .matcher import find_amounts
+from .providers import FailoverProvider, FileRateProvider, OpenExchangeRateProvider
+from .rates import RateCache, RatesUnavailable
+from .watches import Watch, WatchIndex
+
+INLINE_COOLDOWN = 15
+MAX_WATCHES = 25
+SPARKS = "\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
 
 class CurrencyConvert(commands.Cog):
     """Built to help with currency conversions in Treachery Discord"""
 
     def __init__(self, bot):
         self.bot = bot
+        self.config = Config.get_conf(self, identifier=7338014529, force_registration=True)
+        self.config.register_global(rate_ttl=3600, providers=["api"], fixture_path=None)
+        self.config.register_guild(home_currencies=["USD"])
+        self.config.register_channel(inline_convert=False)
+        self.config.register_user(watches={}, next_watch_id=1)
+        self.rates = RateCache(cog_data_path(self) / "rates.json", FailoverProvider([OpenExchangeRateProvider()]))
+        self.history = RateHistory(cog_data_path(self) / "history.sqlite3")
+        self.rates.listeners.append(self._record_history)
+        self.rates.listeners.append(self._check_watches)
+        self.watches = WatchIndex()
+        self._user_watches = {}
+        self._refresh_task = None
+        # Mirrors of Config so the message listener never has to await anything.
+        self._inline_channels = set()
+        self._home_currencies = {}
+        self._inline_last_reply = {}
+
+    async def cog_load(self):
+        self.rates.ttl = await self.config.rate_ttl()
+        await self._set_provider()
+        await self.rates.load()
+        self._start_refresh()
+        self._inline_channels = {cid for cid, data in (await self.config.all_channels()).items() if data["inline_convert"]}
+        self._home_currencies = {gid: data["home_currencies"] for gid, data in (await self.config.all_guilds()).items()}
+        for user_id, data in (await self.config.all_users()).items():
+            for watch_id, watch_data in data["watches"].items():
+                self._add_watch(Watch.from_json(user_id, watch_id, watch_data))
+
+    async def cog_unload(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        await self.rates.close()
+        await self.history.close()
+
+    def _start_refresh(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        self._refresh_task = asyncio.create_task(self.rates.run())
+
+    async def _set_provider(self):
+        """Rebuild the provider chain from Config."""
+        settings = await self.config.all()
+        providers = []
+        for name in settings["providers"]:
+            if name == "api":
+                providers.append(OpenExchangeRateProvider())
+            elif name == "fixture" and settings["fixture_path"]:
+                providers.append(FileRateProvider(settings["fixture_path"]))
+        old, self.rates.provider = self.rates.provider, FailoverProvider(providers or [OpenExchangeRateProvider()])
+        await old.close()
 
-    @commands.command(name="cconv")
-    async def cconv(self, ctx, from_currency: str, to_currency: str, amount: float):
+    async def _record_history(self, old, new):
+        await self.history.append(new)
+
+    def _add_watch(self, watch):
+        self.watches.add(watch)
+        self._user_watches.setdefault(watch.user_id, {})[watch.watch_id] = watch
+
+    async def _check_watches(self, old, new):
+        """Notify everyone whose watch was crossed by this refresh, one message per channel."""
+        if old is None:
+            return
+        by_channel = {}
+        for watch, rate in self.watches.crossed(old, new):
+            lines = by_channel.setdefault(watch.channel_id, {}).setdefault(watch.user_id, [])
+            lines.append(f"{watch.from_currency}/{watch.to_currency} is now {rate:.6g} ({watch.direction} {watch.threshold:g})")
+
+        for channel_id, users in by_channel.items():
+            destination = self.bot.get_channel(channel_id)
+            text = "\n".join(f"<@{user_id}> " + "; ".join(lines) for user_id, lines in users.items())
+            if destination is None:
+                # The watch was set in a DM or the channel is gone, so fall back to each user's DMs.
+                for user_id, lines in users.items():
+                    user = self.bot.get_user(user_id)
+                    if user is not None:
+                        await self._send_quietly(user, "Rate alert: " + "; ".join(lines))
+                continue
+            for page in pagify(text):
+                await self._send_quietly(destination, page, allowed_mentions=discord.AllowedMentions(users=True))
+
+    async def _send_quietly(self, destination, content, **kwargs):
+        try:
+            await destination.send(content, **kwargs)
+        except discord.HTTPException:
+            pass
+
+    @commands.command(name="cconv", usage="<from> <to> <amount> [@date] | [amounts...] <from> to <targets...|*> [@date]")
+    async def cconv(self, ctx, *query: str):
         """Converts currency from one to another.
 
-        Example:
+        Several amounts and target currencies can be converted at once, and `*` converts into every known currency.
+        Add `@YYYY-MM-DD` to use the rates recorded on that date instead of the current ones.
+
+        Examples:
         - `[p]cconv USD CAD 100`
+        - `[p]cconv USD CAD 100 @2026-09-01`
+        - `[p]cconv 100 USD to CAD EUR GBP JPY`
+        - `[p]cconv 10 50 100 EUR to USD`
+        - `[p]cconv USD *`
         """
-        if amount <= 0 or len(from_currency) != 3 or len(to_currency) != 3:
-            return await ctx.send("Invalid input. Amount must be positive and currency codes must be 3 letters long.")
+        try:
+            amounts, from_currency, to_currencies, when = parse_query(query)
+        except ValueError as e:
+            return await ctx.send(str(e))
 
+        if when is not None:
+            snapshot = await self.history.at(when.timestamp())
+            if snapshot is None:
+                return await ctx.send(f"No exchange rates were recorded on or before {when:%Y-%m-%d}.")
+            footer = f"Rates as of {datetime.fromtimestamp(snapshot.updated_at, timezone.utc):%Y-%m-%d %H:%M} UTC."
+        else:
+            try:
+                snapshot = await self.rates.get()
+            except RatesUnavailable:
+                return await ctx.send("Exchange rates are currently unavailable. Please try again later.")
+            footer = f"Rates as of {format_age(snapshot.age)}."
+
+        if to_currencies is None:
+            to_currencies = [code for code in snapshot.codes if code != from_currency]
+        missing = [code for code in (from_currency, *to_currencies) if code not in snapshot.index]
+        if missing:
+            return await ctx.send(f"The conversion rate for these currencies is not available: {', '.join(missing)}.")
+
+        converted = snapshot.convert_many(amounts, from_currency, to_currencies)
+
+        if converted.size == 1:
+            converted_amount = round(float(converted[0, 0]), 2)
+            return await ctx.send(f"{amounts[0]} {from_currency} is equal to {converted_amount} {to_currencies[0]}. *({footer})*")
+
+        pages = list(pagify(format_table(amounts, from_currency, to_currencies, converted), page_length=1800))
+        if len(pages) == 1:
+            return await ctx.send(box(pages[0]) + footer)
+        pages = [f"{box(page)}{footer} Page {i}/{len(pages)}" for i, page in enumerate(pages, 1)]
+        await menu(ctx, pages, DEFAULT_CONTROLS)
+
+    @commands.command(name="ccchart")
+    async def ccchart(self, ctx, from_currency: str, to_currency: str, period: commands.TimedeltaConverter(minimum=timedelta(hours=1), default_unit="days") = timedelta(days=30)):
+        """Summarises how an exchange rate has moved over a period.
+
+        Example:
+        - `[p]ccchart USD CAD 30d`
+        """
         from_currency, to_currency = from_currency.upper(), to_currency.upper()
+        since = datetime.now(timezone.utc) - period
+        timestamps, values = await self.history.series(from_currency, to_currency, since.timestamp())
+        if len(values) < 2:
+            return await ctx.send(f"Not enough rate history has been recorded for {from_currency}/{to_currency} over that period yet.")
+
+        change = (values[-1] / values[0] - 1) * 100
+        days = (timestamps - timestamps[0]) / 86400
+        slope = np.polyfit(days, values, 1)[0] if days[-1] > 0 else 0.0
+        lines = [
+            f"{from_currency}/{to_currency} over the last {humanize_timedelta(timedelta=period)}",
+            sparkline(values),
+            f"Min    {values.min():.6g}",
+            f"Max    {values.max():.6g}",
+            f"Avg    {values.mean():.6g}",
+            f"Last   {values[-1]:.6g}",
+            f"Change {change:+.2f}%",
+            f"Trend  {slope:+.4g} per day",
+        ]
+        await ctx.send(box("\n".join(lines)) + f"Based on {len(values)} snapshots.")
 
-        response = requests.get(f"https://open.exchangerate-api.com/v6/latest")
-        if response.status_code != 200:
-            return await ctx.send("The request to the API failed.")
+    @commands.group(name="ccwatch", invoke_without_command=True)
+    async def ccwatch(self, ctx, from_currency: str, to_currency: str, direction: str, threshold: float):
+        """Get pinged when an exchange rate crosses a threshold.
 
-        data = response.json()
-        if from_currency not in data["rates"] or to_currency not in data["rates"]:
+        You'll be notified in this channel whenever the rate moves past the threshold.
+
+        Example:
+        - `[p]ccwatch USD CAD above 1.40`
+        """
+        from_currency, to_currency, direction = from_currency.upper(), to_currency.upper(), direction.lower()
+        if direction not in ("above", "below") or threshold <= 0 or not math.isfinite(threshold):
+            return await ctx.send("Please use `above` or `below` followed by a positive rate.")
+        snapshot = self.rates.snapshot
+        if snapshot is not None and (from_currency not in snapshot.index or to_currency not in snapshot.index):
             return await ctx.send("The conversion rate for these currencies is not available.")
+        if len(self._user_watches.get(ctx.author.id, {})) >= MAX_WATCHES:
+            return await ctx.send(f"You can have at most {MAX_WATCHES} watches. Remove one with `{ctx.clean_prefix}ccwatch remove`.")
+
+        async with self.config.user(ctx.author).all() as data:
+            watch_id = str(data["next_watch_id"])
+            data["next_watch_id"] += 1
+            watch = Watch(ctx.author.id, watch_id, from_currency, to_currency, direction, threshold, ctx.channel.id)
+            data["watches"][watch_id] = watch.to_json()
+        self._add_watch(watch)
+        await ctx.send(f"Watch {watch.describe()} added.")
+
+    @ccwatch.command(name="list")
+    async def ccwatch_list(self, ctx):
+        """List your rate watches."""
+        watches = self._user_watches.get(ctx.author.id)
+        if not watches:
+            return await ctx.send("You don't have any rate watches.")
+        await ctx.send("\n".join(watch.describe() for watch in watches.values()))
+
+    @ccwatch.command(name="remove", aliases=["delete"])
+    async def ccwatch_remove(self, ctx, watch_id: str):
+        """Remove one of your rate watches by its ID."""
+        watch = self._user_watches.get(ctx.author.id, {}).pop(watch_id, None)
+        if watch is None:
+            return await ctx.send("You don't have a watch with that ID.")
+        self.watches.remove(watch)
+        async with self.config.user(ctx.author).watches() as watches:
+            watches.pop(watch_id, None)
+        await ctx.send(f"Watch {watch.describe()} removed.")
+
+    @commands.Cog.listener()
+    async def on_message_without_command(self, message):
+        """Replies with conversions of prices posted in channels with inline conversion enabled."""
+        if message.channel.id not in self._inline_channels or message.author.bot:
+            return
+
+        snapshot = self.rates.snapshot
+        if snapshot is None:
+            return
+
+        found = find_amounts(message.content, snapshot.index)
+        if not found:
+            return
+
+        now = time.monotonic()
+        if now - self._inline_last_reply.get(message.channel.id, 0) < INLINE_COOLDOWN:
+            return
+        self._inline_last_reply[message.channel.id] = now
+
+        home = [code for code in self._home_currencies.get(message.guild.id, ["USD"]) if code in snapshot.index]
+        lines = []
+        for amount, code in found:
+            targets = [target for target in home if target != code]
+            if not targets:
+                continue
+            converted = snapshot.convert_many([amount], code, targets)[0]
+            lines.append(f"{amount:,.2f} {code} \u2248 " + " \u00b7 ".join(f"{value:,.2f} {target}" for value, target in zip(converted, targets)))
+
+        if lines:
+            await message.reply("\n".join(lines), mention_author=False)
+
+    @commands.group(name="ccset")
+    async def ccset(self, ctx):
+        """Configure CurrencyConvert."""
+
+    @ccset.command(name="inline")
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_channels=True)
+    async def ccset_inline(self, ctx, channel: discord.TextChannel = None):
+        """Toggle automatic conversion of prices posted in a channel."""
+        channel = channel or ctx.channel
+        enabled = not await self.config.channel(channel).inline_convert()
+        await self.config.channel(channel).inline_convert.set(enabled)
+        if enabled:
+            self._inline_channels.add(channel.id)
+            await ctx.send(f"Prices posted in {channel.mention} will now be converted automatically.")
+        else:
+            self._inline_channels.discard(channel.id)
+            await ctx.send(f"Prices posted in {channel.mention} will no longer be converted.")
+
+    @ccset.command(name="home")
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def ccset_home(self, ctx, *currencies: str):
+        """Set the currencies that inline conversions are shown in.
+
+        Example:
+        - `[p]ccset home USD CAD EUR`
+        """
+        codes = list(dict.fromkeys(code.upper() for code in currencies))
+        if not codes or len(codes) > 5 or any(len(code) != 3 or not code.isalpha() for code in codes):
+            return await ctx.send("Please give between one and five 3 letter currency codes.")
+        await self.config.guild(ctx.guild).home_currencies.set(codes)
+        self._home_currencies[ctx.guild.id] = codes
+        await ctx.send(f"Inline conversions will be shown in {', '.join(codes)}.")
+
+    @ccset.command(name="providers")
+    @commands.is_owner()
+    async def ccset_providers(self, ctx, *names: str):
+        """Set which rate providers are used, in failover order.
+
+        Providers are `api` (open.exchangerate-api.com) and `fixture` (the file set with `[p]ccset fixture`).
+
+        Example:
+        - `[p]ccset providers api fixture`
+        """
+        names = [name.lower() for name in names]
+        if not names or any(name not in ("api", "fixture") for name in names):
+            return await ctx.send("Please list one or more of `api` and `fixture`, in the order they should be tried.")
+        await self.config.providers.set(list(dict.fromkeys(names)))
+        await self._set_provider()
+        await ctx.send(f"Rates will be fetched from: {', '.join(dict.fromkeys(names))}.")
+
+    @ccset.command(name="fixture")
+    @commands.is_owner()
+    async def ccset_fixture(self, ctx, *, path: str = None):
+        """Set the JSON file used by the `fixture` provider, or clear it."""
+        await self.config.fixture_path.set(path)
+        await self._set_provider()
+        if path:
+            await ctx.send(f"The fixture provider will read rates from `{path}`.")
+        else:
+            await ctx.send("The fixture provider has been cleared.")
+
+    @ccset.command(name="ttl")
+    @commands.is_owner()
+    async def ccset_ttl(self, ctx, minutes: int):
+        """Set how many minutes exchange rates are cached before being refreshed."""
+        if minutes < 5:
+            return await ctx.send("The cache lifetime must be at least 5 minutes.")
+        await self.config.rate_ttl.set(minutes * 60)
+        self.rates.ttl = minutes * 60
+        self._start_refresh()
+        await ctx.send(f"Exchange rates will now be refreshed every {minutes} minutes.")
+
+    async def red_delete_data_for_user(self, *, requester, user_id):
+        for watch in self._user_watches.pop(user_id, {}).values():
+            self.watches.remove(watch)
+        await self.config.user_from_id(user_id).clear()
+
+def format_age(seconds):
+    if seconds < 60:
+        return "just now"
+    return f"{humanize_timedelta(seconds=int(seconds))} ago"
+
+def parse_query(tokens):
+    """Split a cconv query into its amounts, source currency and target currencies.
+
+    Numbers are amounts (defaulting to 1), the first currency code is the source and every
+    later code is a target. ``to`` is optional filler and ``*`` selects every target, which
+    is returned as ``None``. ``@YYYY-MM-DD`` asks for historical rates, returned as the
+    UTC datetime to look them up at.
+    """
+    amounts, codes, everything, when = [], [], False, None
+    for token in tokens:
+        if token.lower() == "to":
+            continue
+        if token.startswith("@"):
+            when = parse_when(token[1:])
+            continue
+        if token == "*":
+            everything = True
+            continue
+        try:
+            amounts.append(float(token.replace(",", "")))
+            continue
+        except ValueError:
+            pass
+        if len(token) != 3 or not token.isalpha():
+            raise ValueError(f"`{token}` is not a valid amount or 3 letter currency code.")
+        codes.append(token.upper())
+
+    if not codes or (len(codes) == 1 and not everything):
+        raise ValueError("Please give a currency to convert from and at least one currency to convert to.")
+    if any(not math.isfinite(amount) or amount <= 0 for amount in amounts):
+        raise ValueError("Invalid input. Amount must be positive and currency codes must be 3 letters long.")
+
+    return amounts or [1.0], codes[0], None if everything else codes[1:], when
+
+def parse_when(text):
+    """Parse an ISO date or datetime in UTC; a bare date means the end of that day."""
+    try:
+        when = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"`{text}` is not a valid date. Please use the YYYY-MM-DD format.") from None
+    if len(text) == 10:
+        when += timedelta(days=1, seconds=-1)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when
 
-        from_rate, to_rate = data["rates"][from_currency], data["rates"][to_currency]
-        converted_amount = round(amount * to_rate / from_rate, 2)
+def sparkline(values, width=40):
+    """Draw values as a one line block chart, averaging them down to at most ``width`` points."""
+    buckets = np.array_split(values, min(width, len(values)))
+    points = np.array([bucket.mean() for bucket in buckets])
+    low, high = points.min(), points.max()
+    if high == low:
+        return SPARKS[3] * len(points)
+    scaled = ((points - low) / (high - low) * (len(SPARKS) - 1)).round().astype(int)
+    return "".join(SPARKS[i] for i in scaled)
 
-        await ctx.send(f"{amount} {from_currency} is equal to {converted_amount} {to_currency}.")
+def format_table(amounts, from_currency, to_currencies, converted):
+    headers = [f"{amount:,.2f} {from_currency}" for amount in amounts]
+    width = max(len(header) for header in headers)
+    width = max(width, *(len(f"{value:,.2f}") for value in converted.flat))
+    lines = ["    " + " ".join(header.rjust(width) for header in headers)]
+    for column, code in enumerate(to_currencies):
+        lines.append(f"{code} " + " ".join(f"{value:,.2f}".rjust(width) for value in converted[:, column]))
+    return "\n".join(lines)
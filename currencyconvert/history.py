@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .rates import RateSnapshot
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS codesets (id INTEGER PRIMARY KEY, codes TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS snapshots (
+    updated_at INTEGER PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    base TEXT NOT NULL,
+    codeset INTEGER NOT NULL REFERENCES codesets(id),
+    rates BLOB NOT NULL
+);
+"""
+
+
+class RateHistory:
+    """An append-only SQLite time series of rate snapshots.
+
+    Each row holds one snapshot as a packed float64 array, with the currency codes it is
+    ordered by stored once per distinct set in ``codesets``. Rows are keyed by the provider's
+    update time, which is the table's rowid, so point-in-time lookups are a single B-tree
+    search and re-fetching an unchanged table stores nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # One worker thread owns the connection, which also serialises access to it.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="currencyconvert-history")
+        self._conn = None
+        self._codesets = {}
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def append(self, snapshot):
+        await self._run(self._append, snapshot)
+
+    async def at(self, timestamp):
+        """Return the latest snapshot recorded at or before ``timestamp``, or None."""
+        return await self._run(self._at, timestamp)
+
+    async def series(self, from_currency, to_currency, since):
+        """Return ``(timestamps, rates)`` arrays for one pair from ``since`` onwards."""
+        return await self._run(self._series, from_currency, to_currency, since)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+            self._codesets = {codes: id_ for id_, codes in self._conn.execute("SELECT id, codes FROM codesets")}
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _codeset_id(self, codes):
+        key = ",".join(codes)
+        if key not in self._codesets:
+            cur = self._conn.execute("INSERT INTO codesets (codes) VALUES (?)", (key,))
+            self._codesets[key] = cur.lastrowid
+        return self._codesets[key]
+
+    def _append(self, snapshot):
+        conn = self._connect()
+        rates = np.array([snapshot.rates[code] for code in snapshot.codes], dtype="<f8")
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO snapshots (updated_at, fetched_at, base, codeset, rates) VALUES (?, ?, ?, ?, ?)",
+                (int(snapshot.updated_at), snapshot.fetched_at, snapshot.base, self._codeset_id(snapshot.codes), rates.tobytes()),
+            )
+
+    def _at(self, timestamp):
+        row = self._connect().execute(
+            "SELECT s.updated_at, s.base, c.codes, s.rates FROM snapshots s JOIN codesets c ON c.id = s.codeset "
+            "WHERE s.updated_at <= ? ORDER BY s.updated_at DESC LIMIT 1",
+            (int(timestamp),),
+        ).fetchone()
+        if row is None:
+            return None
+        updated_at, base, codes, blob = row
+        rates = np.frombuffer(blob, dtype="<f8")
+        return RateSnapshot(base, dict(zip(codes.split(","), rates.tolist())), updated_at, updated_at)
+
+    def _series(self, from_currency, to_currency, since):
+        rows = self._connect().execute(
+            "SELECT s.updated_at, c.codes, s.rates FROM snapshots s JOIN codesets c ON c.id = s.codeset "
+            "WHERE s.updated_at >= ? ORDER BY s.updated_at",
+            (int(since),),
+        )
+        timestamps, values = [], []
+        positions = {}
+        for updated_at, codes, blob in rows:
+            if codes not in positions:
+                order = codes.split(",")
+                positions[codes] = (order.index(from_currency), order.index(to_currency)) if from_currency in order and to_currency in order else None
+            if positions[codes] is None:
+                continue
+            i, j = positions[codes]
+            rates = np.frombuffer(blob, dtype="<f8")
+            timestamps.append(updated_at)
+            values.append(rates[j] / rates[i])
+        return np.array(timestamps, dtype=np.int64), np.array(values, dtype=np.float64)
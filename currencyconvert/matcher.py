@@ -0,0 +1,68 @@
+import re
+
+# Symbols are matched longest first so that "C$" is never read as a bare "$".
+SYMBOLS = {
+    "US$": "USD",
+    "C$": "CAD",
+    "CA$": "CAD",
+    "A$": "AUD",
+    "AU$": "AUD",
+    "NZ$": "NZD",
+    "$": "USD",
+    "€": "EUR",
+    "£": "GBP",
+    "¥": "JPY",
+    "₹": "INR",
+    "₩": "KRW",
+    "₽": "RUB",
+    "₺": "TRY",
+    "₱": "PHP",
+    "₪": "ILS",
+    "₫": "VND",
+    "₴": "UAH",
+    "฿": "THB",
+    "zł": "PLN",
+}
+
+_SYMBOL = "|".join(re.escape(symbol) for symbol in sorted(SYMBOLS, key=len, reverse=True))
+_AMOUNT = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+
+# Every supported form in one pattern: "$120", "$120 USD", "120 USD", "45€" and "45 €".
+PATTERN = re.compile(
+    rf"(?<![\w.])(?:"
+    rf"(?P<prefix>{_SYMBOL})\s?(?P<prefix_amount>{_AMOUNT})(?:\s?(?P<prefix_code>[A-Z]{{3}})\b)?"
+    rf"|(?P<amount>{_AMOUNT})\s?(?:(?P<code>[A-Z]{{3}})\b|(?P<suffix>{_SYMBOL}))"
+    rf")"
+)
+
+# A message can only contain a price if it contains a digit, and most chat doesn't.
+PREFILTER = re.compile(r"\d")
+
+
+def find_amounts(content, known_codes, limit=5):
+    """Return up to ``limit`` ``(amount, currency_code)`` pairs mentioned in ``content``.
+
+    Explicit codes win over symbols, so "$120 CAD" is read as CAD. Codes that aren't in
+    ``known_codes`` are ignored, which keeps things like "100 LOL" from matching, and after
+    a symbol they fall back to the symbol's currency, so "$20 OFF" is still read as USD.
+    """
+    if not PREFILTER.search(content):
+        return []
+
+    found = []
+    for match in PATTERN.finditer(content):
+        if match["prefix"] is not None:
+            amount, code = match["prefix_amount"], match["prefix_code"]
+            # "$5 FOR you" or "$20 OFF": a capitalised word, not a code, so the symbol decides
+            if code not in known_codes:
+                code = SYMBOLS[match["prefix"]]
+        else:
+            amount, code = match["amount"], match["code"] or SYMBOLS[match["suffix"]]
+        if code not in known_codes:
+            continue
+        value = float(amount.replace(",", ""))
+        if value > 0:
+            found.append((value, code))
+            if len(found) >= limit:
+                break
+    return found
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+from .rates import RateSnapshot
+
+log = logging.getLogger("red.treachery.currencyconvert.providers")
+
+
+class ProviderError(Exception):
+    """Raised when a provider can't supply a usable rate table."""
+
+
+def normalize(base, rates, updated_at=None):
+    """Build a snapshot from raw provider data, dropping anything that isn't a positive rate."""
+    clean = {}
+    for code, rate in rates.items():
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            continue
+        if len(code) == 3 and rate > 0:
+            clean[code.upper()] = rate
+    if not clean:
+        raise ProviderError("The rate table is empty.")
+    base = base.upper()
+    if base not in clean:
+        clean[base] = 1.0
+    return RateSnapshot(base, clean, time.time(), updated_at)
+
+
+class RateProvider:
+    """A source of exchange rates.
+
+    Subclasses implement :meth:`fetch_rates`, returning a :class:`RateSnapshot`. ``timeout``
+    is how long :class:`FailoverProvider` gives this provider before moving on.
+    """
+
+    name = "provider"
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+
+    async def fetch_rates(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class OpenExchangeRateProvider(RateProvider):
+    """Fetches the latest rates from open.exchangerate-api.com."""
+
+    name = "api"
+    url = "https://open.exchangerate-api.com/v6/latest"
+
+    def __init__(self, timeout=10):
+        super().__init__(timeout)
+        self._session = None
+
+    async def fetch_rates(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        async with self._session.get(self.url) as resp:
+            if resp.status != 200:
+                raise ProviderError(f"The rate API returned HTTP {resp.status}.")
+            try:
+                data = await resp.json(content_type=None)
+            except ValueError as e:
+                # A maintenance page or a truncated body rather than JSON
+                raise ProviderError(f"The rate API returned an unreadable response: {e}") from e
+        if not isinstance(data, dict):
+            raise ProviderError("The rate API returned something other than a JSON object.")
+        if data.get("result", "success") != "success" or not isinstance(data.get("rates"), dict):
+            raise ProviderError(f"Unexpected response from rate API: {data.get('error-type', data)}")
+        return normalize(data.get("base_code", "USD"), data["rates"], data.get("time_last_update_unix"))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class FileRateProvider(RateProvider):
+    """Serves rates from a local JSON file, for offline use and tests.
+
+    The file may be a saved API response (``base_code``/``rates``) or a snapshot written by
+    the cog (``base``/``rates``). Without an update time in the file, its mtime is used.
+    """
+
+    name = "fixture"
+
+    def __init__(self, path, timeout=5):
+        super().__init__(timeout)
+        self.path = path
+
+    async def fetch_rates(self):
+        try:
+            data, mtime = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except (OSError, ValueError) as e:
+            raise ProviderError(f"Couldn't read rate fixture {self.path}: {e}") from e
+        if not isinstance(data, dict) or "rates" not in data:
+            raise ProviderError(f"Rate fixture {self.path} has no rates.")
+        base = data.get("base_code") or data.get("base") or "USD"
+        updated_at = data.get("time_last_update_unix") or data.get("updated_at") or mtime
+        return normalize(base, data["rates"], updated_at)
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f), os.path.getmtime(self.path)
+
+
+class FailoverProvider(RateProvider):
+    """Tries each provider in order, giving each its own timeout, until one succeeds."""
+
+    name = "failover"
+
+    def __init__(self, providers):
+        super().__init__(timeout=sum(provider.timeout for provider in providers))
+        self.providers = providers
+
+    async def fetch_rates(self):
+        errors = []
+        for provider in self.providers:
+            try:
+                return await asyncio.wait_for(provider.fetch_rates(), provider.timeout)
+            except asyncio.TimeoutError:
+                errors.append(f"{provider.name}: timed out after {provider.timeout}s")
+            except (ProviderError, aiohttp.ClientError, ValueError) as e:
+                errors.append(f"{provider.name}: {e}")
+            log.warning("Rate provider %s failed, trying the next one", provider.name)
+        raise ProviderError("All rate providers failed: " + "; ".join(errors))
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
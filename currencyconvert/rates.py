@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import time
+
+import numpy as np
+
+log = logging.getLogger("red.treachery.currencyconvert.rates")
+
+
+class RatesUnavailable(Exception):
+    """Raised when there is no snapshot to serve and the provider can't supply one."""
+
+
+class CircuitBreaker:
+    """Stops hammering a failing provider by backing off exponentially between attempts."""
+
+    def __init__(self, base_delay=30, max_delay=1800):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self):
+        return time.monotonic() >= self.open_until
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        self.open_until = time.monotonic() + delay
+        return delay
+
+
+class RateSnapshot:
+    """A table of exchange rates against a single base currency, as fetched at one point in time.
+
+    On construction the rates are expanded into a dense cross-rate matrix, where
+    ``matrix[index[a], index[b]]`` is the number of ``b`` one unit of ``a`` buys, so any pair
+    or row of pairs can be answered without recomputing ratios.
+    """
+
+    def __init__(self, base, rates, fetched_at, updated_at=None):
+        self.base = base
+        self.rates = rates
+        self.fetched_at = fetched_at
+        # When the provider last changed the table, which can be well before we fetched it.
+        self.updated_at = updated_at if updated_at is not None else fetched_at
+        self.codes = sorted(rates)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        vector = np.array([rates[code] for code in self.codes], dtype=np.float64)
+        self.matrix = np.outer(1.0 / vector, vector)
+
+    @property
+    def age(self):
+        """Seconds since this snapshot was fetched."""
+        return max(0.0, time.time() - self.fetched_at)
+
+    def convert(self, amount, from_currency, to_currency):
+        return amount * float(self.matrix[self.index[from_currency], self.index[to_currency]])
+
+    def convert_many(self, amounts, from_currency, to_currencies):
+        """Convert every amount into every target currency in one pass.
+
+        Returns an array of shape ``(len(amounts), len(to_currencies))``.
+        """
+        row = self.matrix[self.index[from_currency]]
+        columns = [self.index[code] for code in to_currencies]
+        return np.outer(np.asarray(amounts, dtype=np.float64), row[columns])
+
+    def to_json(self):
+        return {"base": self.base, "rates": self.rates, "fetched_at": self.fetched_at, "updated_at": self.updated_at}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["base"], data["rates"], data["fetched_at"], data.get("updated_at"))
+
+
+class RateCache:
+    """Owns the current rate snapshot and keeps it fresh.
+
+    The snapshot is fetched from ``provider`` (see :mod:`.providers`), refreshed in the
+    background once it is older than ``ttl`` seconds and
+    written to ``path`` so that a restarted bot can answer immediately from disk. Refreshes
+    are single-flight: concurrent callers share one upstream request, stale rates keep being
+    served while it runs, and a circuit breaker backs off from a provider that keeps failing.
+    """
+
+    def __init__(self, path, provider, ttl=3600):
+        self.path = path
+        self.provider = provider
+        self.ttl = ttl
+        self.snapshot = None
+        self.breaker = CircuitBreaker()
+        self.upstream_calls = 0
+        # Coroutine functions called with (old, new) snapshots after every successful refresh.
+        self.listeners = []
+        self._inflight = None
+
+    def is_stale(self):
+        return self.snapshot is None or self.snapshot.age >= self.ttl
+
+    async def load(self):
+        """Load the last persisted snapshot, if there is one."""
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError):
+            log.warning("Ignoring unreadable rate snapshot at %s", self.path, exc_info=True)
+            return
+        self.snapshot = RateSnapshot.from_json(data)
+
+    async def get(self):
+        """Return the current snapshot, only waiting on the provider if nothing is cached yet."""
+        if self.snapshot is None:
+            return await self.refresh()
+        if self.is_stale() and self.breaker.allow():
+            self._start_refresh()
+        return self.snapshot
+
+    async def refresh(self):
+        """Refresh the snapshot, joining the in-flight refresh if there already is one."""
+        if self._inflight is None and not self.breaker.allow():
+            if self.snapshot is None:
+                raise RatesUnavailable("The rate provider is unavailable.")
+            return self.snapshot
+        try:
+            return await asyncio.shield(self._start_refresh())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.snapshot is None:
+                raise RatesUnavailable("The rate provider is unavailable.") from e
+            return self.snapshot
+
+    def _start_refresh(self):
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._refresh())
+            self._inflight.add_done_callback(self._refresh_done)
+        return self._inflight
+
+    def _refresh_done(self, task):
+        self._inflight = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            delay = self.breaker.record_failure()
+            log.warning("Failed to refresh exchange rates, backing off for %ss", delay, exc_info=task.exception())
+        else:
+            self.breaker.record_success()
+
+    async def _refresh(self):
+        self.upstream_calls += 1
+        snapshot = await self.provider.fetch_rates()
+        old, self.snapshot = self.snapshot, snapshot
+        await asyncio.get_running_loop().run_in_executor(None, self._write, self.snapshot.to_json())
+        for listener in self.listeners:
+            try:
+                await listener(old, self.snapshot)
+            except Exception:
+                log.exception("Rate refresh listener %r failed", listener)
+        return self.snapshot
+
+    async def run(self):
+        """Refresh the snapshot forever, sleeping until it next goes stale."""
+        while True:
+            if self.is_stale():
+                try:
+                    await self.refresh()
+                except RatesUnavailable:
+                    pass
+            if self.is_stale():
+                delay = self.breaker.open_until - time.monotonic()
+            else:
+                delay = self.ttl - self.snapshot.age
+            await asyncio.sleep(max(1.0, delay))
+
+    async def close(self):
+        if self._inflight is not None:
+            self._inflight.cancel()
+        await self.provider.close()
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, data):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        tmp.replace(self.path)
@@ -0,0 +1,107 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+class Watch:
+    """A user's request to be told when a rate crosses a threshold."""
+
+    __slots__ = ("user_id", "watch_id", "from_currency", "to_currency", "direction", "threshold", "channel_id")
+
+    def __init__(self, user_id, watch_id, from_currency, to_currency, direction, threshold, channel_id):
+        self.user_id = user_id
+        self.watch_id = watch_id
+        self.from_currency = from_currency
+        self.to_currency = to_currency
+        self.direction = direction
+        self.threshold = threshold
+        self.channel_id = channel_id
+
+    @property
+    def pair(self):
+        return self.from_currency, self.to_currency
+
+    def to_json(self):
+        return {
+            "from": self.from_currency,
+            "to": self.to_currency,
+            "direction": self.direction,
+            "threshold": self.threshold,
+            "channel_id": self.channel_id,
+        }
+
+    @classmethod
+    def from_json(cls, user_id, watch_id, data):
+        return cls(user_id, watch_id, data["from"], data["to"], data["direction"], data["threshold"], data["channel_id"])
+
+    def describe(self):
+        return f"`{self.watch_id}` {self.from_currency}/{self.to_currency} {self.direction} {self.threshold:g}"
+
+
+class _Side:
+    """Watches for one pair and direction, kept sorted by threshold."""
+
+    __slots__ = ("thresholds", "watches")
+
+    def __init__(self):
+        self.thresholds = []
+        self.watches = []
+
+    def add(self, watch):
+        i = bisect_right(self.thresholds, watch.threshold)
+        self.thresholds.insert(i, watch.threshold)
+        self.watches.insert(i, watch)
+
+    def remove(self, watch):
+        i = bisect_left(self.thresholds, watch.threshold)
+        while i < len(self.thresholds) and self.thresholds[i] == watch.threshold:
+            if self.watches[i] is watch:
+                del self.thresholds[i]
+                del self.watches[i]
+                return
+            i += 1
+
+
+class WatchIndex:
+    """All threshold watches, indexed per pair so a refresh only bisects to the crossed ones.
+
+    "above" watches fire when the rate rises to or past their threshold and "below" watches
+    when it falls to or past it, so each crossing notifies once rather than on every refresh.
+    """
+
+    def __init__(self):
+        self._pairs = defaultdict(lambda: {"above": _Side(), "below": _Side()})
+
+    def add(self, watch):
+        self._pairs[watch.pair][watch.direction].add(watch)
+
+    def remove(self, watch):
+        sides = self._pairs.get(watch.pair)
+        if sides is None:
+            return
+        sides[watch.direction].remove(watch)
+        if not sides["above"].watches and not sides["below"].watches:
+            del self._pairs[watch.pair]
+
+    def __len__(self):
+        return sum(len(side.watches) for sides in self._pairs.values() for side in sides.values())
+
+    def crossed(self, old, new):
+        """Return ``(watch, rate)`` for every watch whose threshold lies between two snapshots."""
+        fired = []
+        for (from_currency, to_currency), sides in self._pairs.items():
+            if from_currency not in old.index or to_currency not in old.index:
+                continue
+            if from_currency not in new.index or to_currency not in new.index:
+                continue
+            before = old.convert(1, from_currency, to_currency)
+            after = new.convert(1, from_currency, to_currency)
+            if after > before:
+                side = sides["above"]
+                start, stop = bisect_right(side.thresholds, before), bisect_right(side.thresholds, after)
+            elif after < before:
+                side = sides["below"]
+                start, stop = bisect_left(side.thresholds, after), bisect_left(side.thresholds, before)
+            else:
+                continue
+            fired.extend((watch, after) for watch in side.watches[start:stop])
+        return fired
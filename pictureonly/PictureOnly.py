@@ -1,54 +1,348 @@
+import asyncio
+import time
+from collections import Counter
+from datetime import timedelta
+
 import discord
 from redbot.core import commands, Config, utils, checks, bot
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box
+from PIL import Image
+
+from .phash import HashIndex, MultiIndex, dhash
+
+# Seconds to collect violations before deleting them in one bulk request
+FLUSH_INTERVAL = 2.0
+# Seconds before the same user is warned again in the same channel
+WARNING_WINDOW = 30
+# Images larger than this aren't downloaded for repost detection
+MAX_HASH_BYTES = 10 * 1024 * 1024
+# Discord only bulk deletes messages younger than 14 days; keep a margin for slow sweeps
+BULK_DELETE_AGE = timedelta(days=14) - timedelta(hours=1)
+# Seconds between single deletes of older messages during a sweep
+SWEEP_DELETE_DELAY = 1.0
+# Seconds between progress updates during a sweep
+SWEEP_PROGRESS_INTERVAL = 5.0
+# Only ordinary messages are swept; system messages like pin and thread notices never are
+SWEEP_MESSAGE_TYPES = (discord.MessageType.default, discord.MessageType.reply)
 
 class PictureOnly(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=1234567890)
         default_guild_settings = {
-            "picture_only_channel": None
+            "picture_only_channel": None,
+            "picture_only_channels": [],
+            "repost_action": "off",
+            "repost_threshold": 6
         }
         self.config.register_guild(**default_guild_settings)
+        self.config.register_channel(sweep_checkpoint=None)
+        # guild ID -> picture-only channel IDs, mirrored from Config so on_message never awaits
+        self.guild_channels = {}
+        self.picture_only_channels = set()
+        # channel ID -> messages waiting to be deleted, and the task that will flush them
+        self._pending = {}
+        self._flush_tasks = {}
+        # (channel ID, user ID) -> when that user was last warned there
+        self._warned = {}
+        self.batch_sizes = Counter()
+        self.warnings_sent = 0
+        self.warnings_suppressed = 0
+        self.hashes = HashIndex(cog_data_path(self) / "hashes")
+        # guild ID -> (repost action, Hamming distance threshold)
+        self.repost_settings = {}
+        self._sweeping = set()
+
+    async def cog_load(self):
+        for guild_id, settings in (await self.config.all_guilds()).items():
+            channels = set(settings["picture_only_channels"])
+            # Migrate the single channel setting from before multiple channels were supported
+            if settings["picture_only_channel"]:
+                channels.add(settings["picture_only_channel"])
+                group = self.config.guild_from_id(guild_id)
+                await group.picture_only_channels.set(list(channels))
+                await group.picture_only_channel.clear()
+            if channels:
+                self.guild_channels[guild_id] = channels
+                self.picture_only_channels |= channels
+            self.repost_settings[guild_id] = (settings["repost_action"], settings["repost_threshold"])
+
+    async def cog_unload(self):
+        for task in self._flush_tasks.values():
+            task.cancel()
+        for channel_id in list(self._pending):
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                await self._flush(channel)
+
+    async def red_delete_data_for_user(self, *, requester, user_id):
+        await self.hashes.remove_author(user_id)
+
+    async def _add_channel(self, guild, channel_id):
+        self.guild_channels.setdefault(guild.id, set()).add(channel_id)
+        self.picture_only_channels.add(channel_id)
+        await self.config.guild(guild).picture_only_channels.set(list(self.guild_channels[guild.id]))
+
+    async def _remove_channel(self, guild, channel_id):
+        self.guild_channels.get(guild.id, set()).discard(channel_id)
+        self.picture_only_channels.discard(channel_id)
+        self.hashes.forget(channel_id)
+        await self.config.guild(guild).picture_only_channels.set(list(self.guild_channels.get(guild.id, ())))
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.bot:
+        if message.channel.id not in self.picture_only_channels or message.author.bot:
             return
 
-        guild_id = message.guild.id
-        picture_only_channel = await self.config.guild(message.guild).picture_only_channel()
+        if self.is_violation(message):
+            self._pending.setdefault(message.channel.id, []).append(message)
+            if message.channel.id not in self._flush_tasks:
+                self._flush_tasks[message.channel.id] = asyncio.create_task(self._flush_later(message.channel))
+            return
+
+        action, threshold = self.repost_settings.get(message.guild.id, ("off", 6))
+        if action != "off":
+            await self._check_repost(message, action, threshold)
+
+    async def _hash_attachments(self, message):
+        """Hash a message's image attachments off the event loop, skipping anything unreadable."""
+        loop = asyncio.get_running_loop()
+        values = []
+        for attachment in message.attachments:
+            if not (attachment.content_type or "").startswith("image/") or attachment.size > MAX_HASH_BYTES:
+                continue
+            try:
+                values.append(await loop.run_in_executor(None, dhash, await attachment.read()))
+            except (discord.HTTPException, OSError, ValueError, Image.DecompressionBombError):
+                continue
+        return values
 
-        # Fixed the indentation of this if block
-        if picture_only_channel and message.channel.id == picture_only_channel:
-            if not message.attachments:
+    async def _check_repost(self, message, action, threshold):
+        values = await self._hash_attachments(message)
+        if not values:
+            return
+        tree = await self.hashes.tree(message.channel.id)
+        original = None
+        for value in values:
+            matches = tree.search(value, threshold)
+            if matches:
+                original = matches[0][1]
+                break
+
+        if original is None:
+            await self.hashes.add(message.channel.id, message.id, values, message.author.id)
+            return
+
+        link = f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{original}"
+        if action == "remove":
+            try:
                 await message.delete()
-                # Added a line to send a message when a message is deleted
-                await message.channel.send(f"{message.author.mention}, messages without pictures are automatically removed from this channel. If you wish to comment on someone else's picture, please start a thread from their message! *This message will be automatically removed in 30 seconds.*", delete_after=30)
+            except discord.NotFound:
+                return
+            await message.channel.send(f"{message.author.mention}, that picture has already been posted here: {link} *This message will be automatically removed in 30 seconds.*", delete_after=30)
+        else:
+            await message.reply(f"This looks like a repost of {link}", mention_author=False)
+
+    @staticmethod
+    def is_violation(message):
+        """Whether a message breaks the picture-only rule."""
+        return not message.author.bot and not message.attachments
+
+    async def _flush_later(self, channel):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        del self._flush_tasks[channel.id]
+        await self._flush(channel)
+
+    async def _delete_batch(self, channel, batch):
+        try:
+            await channel.delete_messages(batch)
+        except discord.HTTPException:
+            # A bulk delete fails outright if any message is already gone, so fall back to singles
+            for message in batch:
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
+        self.batch_sizes[len(batch)] += 1
+
+    async def _flush(self, channel):
+        """Bulk delete a channel's queued violations and warn each author at most once per window."""
+        messages = self._pending.pop(channel.id, [])
+        for i in range(0, len(messages), 100):
+            await self._delete_batch(channel, messages[i:i + 100])
+
+        now = time.monotonic()
+        authors = []
+        for message in messages:
+            key = (channel.id, message.author.id)
+            if now - self._warned.get(key, 0) < WARNING_WINDOW:
+                self.warnings_suppressed += 1
+                continue
+            self._warned[key] = now
+            authors.append(message.author)
+        self._warned = {key: warned for key, warned in self._warned.items() if now - warned < WARNING_WINDOW}
+
+        if authors:
+            self.warnings_sent += 1
+            mentions = ", ".join(author.mention for author in authors)
+            await channel.send(f"{mentions}, messages without pictures are automatically removed from this channel. If you wish to comment on someone else's picture, please start a thread from their message! *This message will be automatically removed in 30 seconds.*", delete_after=30)
 
     @commands.command()
+    @commands.guild_only()
     @commands.has_permissions(manage_channels=True)
     async def enable_picture_only(self, ctx):
         """Enables the picture-only mode in the current channel."""
         channel = ctx.channel
-        await self.config.guild(ctx.guild).picture_only_channel.set(channel.id)
+        await self._add_channel(ctx.guild, channel.id)
         await channel.set_permissions(ctx.guild.default_role, send_messages=False)
         await ctx.send("The channel has been set to picture-only mode.")
 
     @commands.command()
+    @commands.guild_only()
     @commands.has_permissions(manage_channels=True)
     async def disable_picture_only(self, ctx):
         """Disables the picture-only mode in the current channel."""
         channel = ctx.channel
-        await self.config.guild(ctx.guild).picture_only_channel.clear()
+        await self._remove_channel(ctx.guild, channel.id)
         await channel.set_permissions(ctx.guild.default_role, send_messages=True)
         await ctx.send("The channel is no longer in picture-only mode.")
 
     @commands.command()
+    @commands.guild_only()
     @commands.has_permissions(manage_channels=True)
     async def set_picture_only_channel(self, ctx, channel: discord.TextChannel):
-        """Sets the picture-only channel for the guild."""
-        await self.config.guild(ctx.guild).picture_only_channel.set(channel.id)
-        await ctx.send(f"The picture-only channel has been set to {channel.mention}.")
+        """Adds a picture-only channel for the guild."""
+        await self._add_channel(ctx.guild, channel.id)
+        await ctx.send(f"{channel.mention} is now a picture-only channel.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
+    async def picture_only_reposts(self, ctx, action: str, threshold: int = None):
+        """Sets what happens to reposted pictures: `off` (the default), `flag` or `remove`.
+
+        The threshold is how many of the 64 hash bits may differ for two pictures to count as the same (default 6).
+        """
+        action = action.lower()
+        if action not in ("off", "flag", "remove"):
+            return await ctx.send("The action must be `off`, `flag` or `remove`.")
+        if threshold is not None and not 0 <= threshold <= MultiIndex.MAX_RADIUS:
+            return await ctx.send(f"The threshold must be between 0 and {MultiIndex.MAX_RADIUS}.")
+        group = self.config.guild(ctx.guild)
+        await group.repost_action.set(action)
+        if threshold is not None:
+            await group.repost_threshold.set(threshold)
+        self.repost_settings[ctx.guild.id] = (action, await group.repost_threshold())
+        await ctx.send(f"Repost detection is now set to `{action}` with a threshold of {self.repost_settings[ctx.guild.id][1]}.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
+    async def picture_only_backfill(self, ctx, channel: discord.TextChannel = None, limit: int = 1000):
+        """Indexes the pictures already in a channel so that reposts of them are detected."""
+        channel = channel or ctx.channel
+        indexed = skipped = 0
+        async with ctx.typing():
+            async for message in channel.history(limit=limit, oldest_first=True):
+                if message.author.bot or not message.attachments:
+                    continue
+                if await self.hashes.is_indexed(channel.id, message.id):
+                    skipped += 1
+                    continue
+                values = await self._hash_attachments(message)
+                if values:
+                    await self.hashes.add(channel.id, message.id, values, message.author.id)
+                    indexed += 1
+        await ctx.send(f"Indexed {indexed} pictures in {channel.mention} ({skipped} were already indexed).")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
+    async def picture_only_sweep(self, ctx, channel: discord.TextChannel = None, restart: bool = False):
+        """Removes messages without pictures that were posted while the bot wasn't watching.
+
+        Pinned messages and system messages such as pin and thread notices are left alone.
+
+        The sweep remembers how far it got, so running it again continues where it stopped. Pass `True` after the channel to start over from the beginning.
+        """
+        channel = channel or ctx.channel
+        if channel.id not in self.picture_only_channels:
+            return await ctx.send(f"{channel.mention} isn't a picture-only channel, so there's nothing to sweep.")
+        if channel.id in self._sweeping:
+            return await ctx.send(f"{channel.mention} is already being swept.")
+        self._sweeping.add(channel.id)
+        try:
+            await self._sweep(ctx, channel, restart)
+        finally:
+            self._sweeping.discard(channel.id)
+
+    async def _sweep(self, ctx, channel, restart):
+        checkpoint = self.config.channel(channel).sweep_checkpoint
+        if restart:
+            await checkpoint.clear()
+        last_id = await checkpoint()
+        after = discord.Object(last_id) if last_id else None
+        scanned = removed = 0
+        status = await ctx.send(f"Sweeping {channel.mention}{' from the last checkpoint' if last_id else ''}...")
+        last_update = time.monotonic()
+
+        while True:
+            page = [message async for message in channel.history(limit=100, after=after, oldest_first=True)]
+            if not page:
+                break
+            # History goes back to the rules post and pin/thread notices, which have to stay
+            violations = [
+                message for message in page
+                if self.is_violation(message) and not message.pinned and message.type in SWEEP_MESSAGE_TYPES
+            ]
+            cutoff = discord.utils.utcnow() - BULK_DELETE_AGE
+            recent = [message for message in violations if message.created_at > cutoff]
+            if recent:
+                await self._delete_batch(channel, recent)
+            for message in violations:
+                if message.created_at <= cutoff:
+                    try:
+                        await message.delete()
+                    except discord.NotFound:
+                        pass
+                    await asyncio.sleep(SWEEP_DELETE_DELAY)
+
+            scanned += len(page)
+            removed += len(violations)
+            after = page[-1]
+            await checkpoint.set(after.id)
+            if time.monotonic() - last_update >= SWEEP_PROGRESS_INTERVAL:
+                last_update = time.monotonic()
+                await status.edit(content=f"Sweeping {channel.mention}... {scanned} messages checked, {removed} removed so far.")
+
+        await status.edit(content=f"Finished sweeping {channel.mention}: {scanned} messages checked, {removed} removed.")
+
+    @commands.command()
+    @commands.is_owner()
+    async def picture_only_stats(self, ctx):
+        """Shows how violations have been batched."""
+        batches = sum(self.batch_sizes.values())
+        deleted = sum(size * count for size, count in self.batch_sizes.items())
+        lines = [
+            f"Messages deleted    {deleted}",
+            f"Delete requests     {batches}",
+            f"Average batch size  {deleted / batches if batches else 0:.1f}",
+            f"Largest batch       {max(self.batch_sizes, default=0)}",
+            f"Warnings sent       {self.warnings_sent}",
+            f"Warnings suppressed {self.warnings_suppressed}",
+        ]
+        await ctx.send(box("\n".join(lines)))
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
+    async def list_picture_only_channels(self, ctx):
+        """Lists the picture-only channels in the guild."""
+        channels = self.guild_channels.get(ctx.guild.id)
+        if not channels:
+            return await ctx.send("There are no picture-only channels in this guild.")
+        await ctx.send("Picture-only channels: " + ", ".join(f"<#{channel_id}>" for channel_id in channels))
 
 def setup(bot):
     bot.add_cog(PictureOnly(bot))
@@ -0,0 +1,181 @@
+import asyncio
+import io
+import logging
+
+from PIL import Image
+
+log = logging.getLogger("red.treachery.pictureonly.phash")
+
+# Larger pictures are refused from their header, before Pillow decodes any pixels
+MAX_HASH_PIXELS = 40 * 1024 * 1024
+
+
+def dhash(data, size=8):
+    """Return a 64-bit difference hash of an image.
+
+    The image is shrunk to 9x8 greyscale and each bit records whether a pixel is brighter
+    than its right-hand neighbour, which survives rescaling, recompression and small edits.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e)) from e
+    with image:
+        if image.width * image.height > MAX_HASH_PIXELS:
+            raise ValueError(f"{image.width}x{image.height} is too large to hash")
+        image.draft("L", (size * 4, size * 4))
+        pixels = list(image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+if hasattr(int, "bit_count"):
+    def hamming(a, b):
+        return (a ^ b).bit_count()
+else:
+    # int.bit_count only exists on Python 3.10+
+    def hamming(a, b):
+        return bin(a ^ b).count("1")
+
+
+class MultiIndex:
+    """Near-duplicate lookup for 64-bit hashes by multi-index hashing.
+
+    Every hash is split into eight 8-bit chunks, with one table per chunk position. Two
+    hashes within Hamming distance 7 must agree exactly on at least one chunk, so a search
+    only compares the query against entries that share a chunk with it rather than all of them.
+    """
+
+    CHUNKS = 8
+    MAX_RADIUS = CHUNKS - 1
+
+    def __init__(self):
+        self.entries = []
+        self.tables = [{} for _ in range(self.CHUNKS)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, value, item):
+        position = len(self.entries)
+        self.entries.append((value, item))
+        for i, table in enumerate(self.tables):
+            table.setdefault((value >> (8 * i)) & 0xFF, []).append(position)
+
+    def search(self, value, radius):
+        """Return ``(distance, item)`` for every entry within ``radius``, closest first."""
+        radius = min(radius, self.MAX_RADIUS)
+        seen = set()
+        found = []
+        for i, table in enumerate(self.tables):
+            for position in table.get((value >> (8 * i)) & 0xFF, ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+                other, item = self.entries[position]
+                distance = hamming(value, other)
+                if distance <= radius:
+                    found.append((distance, item))
+        found.sort(key=lambda entry: entry[0])
+        return found
+
+
+class HashIndex:
+    """Per-channel multi-index tables of image hashes, persisted as append-only files.
+
+    Each channel's hashes live in ``<directory>/<channel ID>.txt`` as ``hash message_id
+    author_id`` lines. New hashes are appended as they are added and a channel's file is
+    only read the first time that channel is used.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._trees = {}
+        self._indexed = {}
+        self._locks = {}
+        # Appends and author removals both touch the files, so they take turns
+        self._write_lock = asyncio.Lock()
+
+    async def tree(self, channel_id):
+        if channel_id not in self._trees:
+            async with self._locks.setdefault(channel_id, asyncio.Lock()):
+                if channel_id not in self._trees:
+                    entries = await asyncio.get_running_loop().run_in_executor(None, self._read, channel_id)
+                    tree = MultiIndex()
+                    for value, message_id, _ in entries:
+                        tree.add(value, message_id)
+                    self._indexed[channel_id] = {message_id for _, message_id, _ in entries}
+                    self._trees[channel_id] = tree
+        return self._trees[channel_id]
+
+    async def is_indexed(self, channel_id, message_id):
+        await self.tree(channel_id)
+        return message_id in self._indexed[channel_id]
+
+    async def add(self, channel_id, message_id, values, author_id):
+        tree = await self.tree(channel_id)
+        values = list(values)
+        for value in values:
+            tree.add(value, message_id)
+        self._indexed[channel_id].add(message_id)
+        async with self._write_lock:
+            await asyncio.get_running_loop().run_in_executor(None, self._append, channel_id, message_id, values, author_id)
+
+    def forget(self, channel_id):
+        self._trees.pop(channel_id, None)
+        self._indexed.pop(channel_id, None)
+
+    async def remove_author(self, author_id):
+        """Drop every hash of a user's pictures, from disk and from the loaded tables."""
+        async with self._write_lock:
+            changed = await asyncio.get_running_loop().run_in_executor(None, self._remove_author, author_id)
+        # The tables can't remove entries, so affected channels are reloaded on next use
+        for channel_id in changed:
+            self.forget(channel_id)
+
+    def _path(self, channel_id):
+        return self.directory / f"{channel_id}.txt"
+
+    def _read(self, channel_id):
+        entries = []
+        try:
+            with open(self._path(channel_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        # Lines written before authors were recorded only have two fields
+                        value, message_id, *author = line.split()
+                        entries.append((int(value, 16), int(message_id), int(author[0]) if author else None))
+                    except (ValueError, IndexError):
+                        log.warning("Skipping malformed line in %s", self._path(channel_id))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _append(self, channel_id, message_id, values, author_id):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._path(channel_id), "a", encoding="utf-8") as f:
+            f.writelines(f"{value:016x} {message_id} {author_id}\n" for value in values)
+
+    def _remove_author(self, author_id):
+        changed = []
+        if not self.directory.is_dir():
+            return changed
+        for path in self.directory.glob("*.txt"):
+            channel_id = int(path.stem)
+            entries = self._read(channel_id)
+            kept = [entry for entry in entries if entry[2] != author_id]
+            if len(kept) == len(entries):
+                continue
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(
+                    f"{value:016x} {message_id}\n" if author is None else f"{value:016x} {message_id} {author}\n"
+                    for value, message_id, author in kept
+                )
+            tmp.replace(path)
+            changed.append(channel_id)
+        return changed
@@ -0,0 +1,71 @@
+"""Benchmarks for RequestEmoji's header sniffing.
+
+Compares ``sniff`` against opening each image with Pillow, both for reading just the header
+and for a full decode of every frame, which is what deciding on format, size and animation
+used to cost. Run with ``python -m requestemoji.benchmarks`` from the repository root.
+"""
+import io
+import os
+import timeit
+
+from PIL import Image, ImageSequence
+
+from .sniff import sniff
+
+
+def noise(size, count):
+    return [Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)) for _ in range(count)]
+
+
+def encode(image_format, size, count=1, **params):
+    frames = noise(size, count)
+    output = io.BytesIO()
+    if count > 1:
+        frames[0].save(output, format=image_format, save_all=True, append_images=frames[1:], **params)
+    else:
+        frames[0].save(output, format=image_format, **params)
+    return output.getvalue()
+
+
+SAMPLES = [
+    ("PNG 1024x1024", lambda: encode("PNG", (1024, 1024))),
+    ("APNG 256x256, 20 frames", lambda: encode("PNG", (256, 256), 20)),
+    ("JPEG 2048x2048", lambda: encode("JPEG", (2048, 2048), quality=90)),
+    ("GIF 256x256, 40 frames", lambda: encode("GIF", (256, 256), 40)),
+    ("WebP 1024x1024", lambda: encode("WEBP", (1024, 1024))),
+    ("WebP 256x256, 20 frames", lambda: encode("WEBP", (256, 256), 20)),
+]
+
+
+def pillow_header(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.format, image.size, getattr(image, "n_frames", 1)
+
+
+def pillow_decode(data):
+    with Image.open(io.BytesIO(data)) as image:
+        for frame in ImageSequence.Iterator(image):
+            frame.load()
+        return image.format, image.size, getattr(image, "n_frames", 1)
+
+
+def per_call(func, data, budget=0.5):
+    """Microseconds per call, running for roughly ``budget`` seconds."""
+    number = max(1, int(budget / max(timeit.timeit(lambda: func(data), number=1), 1e-7)))
+    return timeit.timeit(lambda: func(data), number=number) / number * 1e6
+
+
+def main():
+    print(f"  {'image':<26} {'size':>9}  {'sniff':>10}  {'Pillow open':>12}  {'full decode':>12}")
+    for label, make in SAMPLES:
+        data = make()
+        info = sniff(data)
+        timings = [per_call(func, data) for func in (sniff, pillow_header, pillow_decode)]
+        print(
+            f"  {label:<26} {len(data) // 1024:>6} KB  {timings[0]:>7.1f} us  {timings[1]:>9.1f} us  "
+            f"{timings[2]:>9.1f} us   {info.frames} frame(s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
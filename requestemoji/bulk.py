@@ -0,0 +1,190 @@
+import io
+import re
+import struct
+import zipfile
+from pathlib import PurePosixPath
+
+import discord
+
+from .download import MAX_DOWNLOAD_BYTES
+from .imaging import encode_emoji, plan_encoding
+from .phash import dhash
+from .sniff import sniff
+
+MAX_ARCHIVE_BYTES = 25 * 1024 * 1024
+MAX_ENTRIES = 100
+# Files of any kind, checked before the archive's directory is parsed
+MAX_ARCHIVE_FILES = 1000
+# Caps what a small archive can decompress to, so a zip bomb is refused before it is read
+MAX_UNCOMPRESSED_BYTES = 100 * 1024 * 1024
+IMAGE_SUFFIXES = (".png", ".apng", ".jpg", ".jpeg", ".gif", ".webp")
+
+
+class ArchiveError(Exception):
+    """Raised when an archive can't be imported at all."""
+
+
+def emoji_name(filename, taken):
+    """Turn an archive entry's file name into a valid emoji name not already in ``taken``."""
+    name = re.sub(r"\W", "_", PurePosixPath(filename).stem, flags=re.ASCII)[:32]
+    if len(name) < 2:
+        name = f"emoji_{name}".rstrip("_")
+    candidate, suffix = name, 2
+    while candidate.lower() in taken:
+        candidate = f"{name[:32 - len(str(suffix)) - 1]}_{suffix}"
+        suffix += 1
+    taken.add(candidate.lower())
+    return candidate
+
+
+def count_archive_files(data):
+    """Return the file count from a zip's end of central directory record, or ``None``.
+
+    The record sits in the last 22 bytes plus up to 64 KB of comment, so this costs the same
+    however many files the archive claims to hold. Zip64 archives report 0xFFFF here.
+    """
+    end = data.rfind(b"PK\x05\x06", max(0, len(data) - 22 - 0xFFFF))
+    if end < 0 or end + 22 > len(data):
+        return None
+    return struct.unpack_from("<H", data, end + 10)[0]
+
+
+def read_archive(data):
+    """Return ``(entries, skipped)`` for a zip archive's images.
+
+    ``entries`` is a list of ``(name, image bytes)`` with names already turned into emoji
+    names, and ``skipped`` a list of ``(filename, reason)`` for entries that were left out.
+    Sizes are checked against the archive's directory before anything is decompressed.
+    """
+    too_many = ArchiveError(f"The archive holds too many files, at most {MAX_ARCHIVE_FILES} are allowed.")
+    count = count_archive_files(data)
+    if count is not None and count > MAX_ARCHIVE_FILES:
+        raise too_many
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ArchiveError("That attachment isn't a valid zip archive.")
+    with archive:
+        if len(archive.infolist()) > MAX_ARCHIVE_FILES:
+            raise too_many
+        images, skipped = [], []
+        for info in archive.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or PurePosixPath(info.filename).name.startswith("."):
+                continue
+            if info.filename.lower().endswith(IMAGE_SUFFIXES):
+                images.append(info)
+            else:
+                skipped.append((info.filename, "not an image file"))
+        if len(images) > MAX_ENTRIES:
+            raise ArchiveError(f"The archive has {len(images)} images, but at most {MAX_ENTRIES} can be imported at once.")
+        if sum(info.file_size for info in images) > MAX_UNCOMPRESSED_BYTES:
+            raise ArchiveError(f"The archive unpacks to more than {MAX_UNCOMPRESSED_BYTES // (1024 * 1024)} MB.")
+
+        entries = []
+        taken = set()
+        for info in sorted(images, key=lambda info: info.filename.lower()):
+            if info.file_size > MAX_DOWNLOAD_BYTES:
+                skipped.append((info.filename, f"larger than {MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB"))
+                continue
+            try:
+                entries.append((emoji_name(info.filename, taken), archive.read(info)))
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                # RuntimeError covers encrypted entries, NotImplementedError unsupported compression
+                skipped.append((info.filename, f"couldn't be extracted ({e})"))
+    return entries, skipped
+
+
+def prepare_entry(name, data):
+    """Validate and encode one archive entry for upload.
+
+    Runs in a worker process, so it returns ``(name, encoded bytes, hash, error)`` with
+    exactly one of the encoded bytes or the error set, rather than raising.
+    """
+    try:
+        info = sniff(data)
+    except ValueError:
+        info = None
+    action = plan_encoding(info, len(data))
+    if action == "reject":
+        return name, None, None, "not a readable PNG, JPG, GIF or WebP image, or far too large"
+    try:
+        if action == "encode":
+            data = encode_emoji(data)
+        return name, data, dhash(data), None
+    except (ValueError, OSError) as e:
+        return name, None, None, str(e)
+
+
+class BulkApprovalView(discord.ui.View):
+    """One page per prepared emoji, where the importing officer picks which ones to upload."""
+
+    def __init__(self, ctx, entries, similar):
+        super().__init__(timeout=600)
+        self.ctx, self.entries, self.similar = ctx, entries, similar
+        self.included = [True] * len(entries)
+        self.current = 0
+        self.approved = None
+        self.message = None
+
+    def page(self):
+        name, data = self.entries[self.current]
+        included = self.included[self.current]
+        embed = discord.Embed(
+            title=f"Bulk import: {name}",
+            description="This emoji will be uploaded." if included else "This emoji will be skipped.",
+            color=discord.Color.green() if included else discord.Color.red(),
+        )
+        if self.similar[self.current]:
+            embed.add_field(name="Looks like existing emojis", value="\n".join(f"{emoji} `:{emoji.name}:`" for emoji in self.similar[self.current]), inline=False)
+        embed.set_image(url="attachment://emoji.png")
+        embed.set_footer(text=f"Emoji {self.current + 1} of {len(self.entries)}, {sum(self.included)} selected for upload")
+        self.toggle.label = "Skip" if included else "Include"
+        self.upload.label = f"Upload {sum(self.included)}"
+        self.upload.disabled = not any(self.included)
+        return embed, discord.File(io.BytesIO(data), filename="emoji.png")
+
+    async def show(self, interaction):
+        embed, file = self.page()
+        await interaction.response.edit_message(embed=embed, attachments=[file], view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user == self.ctx.author:
+            return True
+        await interaction.response.send_message("Only the officer who started this import can use these buttons.", ephemeral=True)
+        return False
+
+    async def on_timeout(self):
+        await self.finish(False)
+
+    async def finish(self, approved):
+        self.approved = approved
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            await self.message.edit(view=self)
+        self.stop()
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.blurple)
+    async def previous(self, interaction, button):
+        self.current = (self.current - 1) % len(self.entries)
+        await self.show(interaction)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.blurple)
+    async def next(self, interaction, button):
+        self.current = (self.current + 1) % len(self.entries)
+        await self.show(interaction)
+
+    @discord.ui.button(label="Skip", style=discord.ButtonStyle.grey)
+    async def toggle(self, interaction, button):
+        self.included[self.current] = not self.included[self.current]
+        await self.show(interaction)
+
+    @discord.ui.button(label="Upload", style=discord.ButtonStyle.green)
+    async def upload(self, interaction, button):
+        await interaction.response.defer()
+        await self.finish(True)
+
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.red)
+    async def cancel(self, interaction, button):
+        await interaction.response.defer()
+        await self.finish(False)
@@ -0,0 +1,58 @@
+import asyncio
+
+import aiohttp
+
+from .sniff import detect_format
+
+# Originals are shrunk by the encoder afterwards, so this only needs to stop abuse
+MAX_DOWNLOAD_BYTES = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Some hosts serve images as generic binary, so those get the magic byte check alone
+ALLOWED_CONTENT_TYPES = ("image/", "application/octet-stream", "binary/octet-stream")
+TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=10)
+
+
+class DownloadError(Exception):
+    """Raised when an image can't be fetched or isn't an acceptable image."""
+
+
+def check_attachment(attachment, limit=MAX_DOWNLOAD_BYTES):
+    """Reject an attachment from its metadata, before any of it is downloaded."""
+    if attachment.size > limit:
+        raise DownloadError(f"The image is too large, the limit is {limit // (1024 * 1024)} MB.")
+    if attachment.content_type is not None and not attachment.content_type.startswith(ALLOWED_CONTENT_TYPES):
+        raise DownloadError("The attachment isn't an image. Please use a PNG, JPG, GIF or WebP file.")
+
+
+async def fetch_image(session, url, limit=MAX_DOWNLOAD_BYTES):
+    """Stream an image from ``url``, giving up as soon as it is too large or not an image."""
+    if not url.startswith(("http://", "https://")):
+        raise DownloadError("That isn't a valid image URL.")
+    try:
+        async with session.get(url, timeout=TIMEOUT) as resp:
+            if resp.status != 200:
+                raise DownloadError("Failed to fetch image from URL.")
+            if not resp.content_type.startswith(ALLOWED_CONTENT_TYPES):
+                raise DownloadError("The URL doesn't point to an image.")
+            if resp.content_length is not None and resp.content_length > limit:
+                raise DownloadError(f"The image is too large, the limit is {limit // (1024 * 1024)} MB.")
+
+            data = bytearray()
+            checked = False
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                data += chunk
+                if len(data) > limit:
+                    raise DownloadError(f"The image is too large, the limit is {limit // (1024 * 1024)} MB.")
+                # Chunks can be tiny, so wait until there are enough bytes to tell the format apart
+                if not checked and len(data) >= 12:
+                    if detect_format(bytes(data[:12])) is None:
+                        raise DownloadError("The URL doesn't point to a PNG, JPG, GIF or WebP image.")
+                    checked = True
+            if not checked and detect_format(bytes(data)) is None:
+                raise DownloadError("The URL doesn't point to a PNG, JPG, GIF or WebP image.")
+            return bytes(data)
+    except (aiohttp.InvalidURL, ValueError):
+        # ValueError covers host names that fail IDNA encoding, like "a..b"
+        raise DownloadError("That isn't a valid image URL.")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise DownloadError("There was an error while fetching the image from the URL.") from e
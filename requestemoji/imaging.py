@@ -0,0 +1,137 @@
+import io
+
+from PIL import Image, ImageSequence
+
+# Discord rejects emoji uploads larger than this
+EMOJI_BYTE_LIMIT = 256000
+EMOJI_SIZE = 128
+# Candidates smaller than this are only used if nothing larger fits the budget
+MIN_GOOD_SIZE = 96
+MIN_SIZE = 32
+# Frames are decoded to RGBA in memory, so refuse anything that would take more than ~256 MB
+MAX_DECODED_PIXELS = 64 * 1024 * 1024
+# Formats Discord takes for emojis as they are. APNG and WebP are converted first.
+UPLOADABLE_FORMATS = ("png", "jpeg", "gif")
+
+# Encoding options from best to worst quality. Static images are tried as lossless PNG, then
+# with a reduced palette. Animations trade palette size first, then drop every other frame.
+STATIC_OPTIONS = [None, 256, 64]
+ANIMATED_OPTIONS = [(256, 1), (128, 1), (64, 1), (256, 2), (128, 2), (64, 2), (32, 2), (64, 3), (32, 3)]
+
+
+def plan_encoding(info, size, budget=EMOJI_BYTE_LIMIT):
+    """Decide from sniffed headers whether to ``"accept"``, ``"encode"`` or ``"reject"`` an image."""
+    if info is None or info.width * info.height * info.frames > MAX_DECODED_PIXELS:
+        return "reject"
+    if size > budget or info.format not in UPLOADABLE_FORMATS or (info.animated and info.format != "gif"):
+        return "encode"
+    return "accept"
+
+
+def load_frames(image):
+    """Return an animation's frames as RGBA, with per-frame durations and disposal methods."""
+    default_duration = 100
+    frames, durations, disposals = [], [], []
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        # WebP only fills in a frame's duration once the frame is loaded
+        frame.load()
+        if index == 0:
+            default_duration = frame.info.get("duration", default_duration)
+        durations.append(frame.info.get("duration", default_duration))
+        disposals.append(getattr(frame, "disposal_method", 0))
+        # Pillow hands back each frame already composited onto the canvas, so resizing it
+        # as RGBA keeps transparency and the original disposal still renders correctly.
+        frames.append(frame.convert("RGBA"))
+    return frames, durations, disposals
+
+
+def render_gif(frames, durations, disposals, loop, size, colors=256, step=1):
+    """Encode frames as a GIF fitting in ``size``, keeping every ``step``th frame."""
+    kept, kept_durations, kept_disposals = [], [], []
+    for i in range(0, len(frames), step):
+        frame = frames[i].copy()
+        frame.thumbnail(size, Image.LANCZOS)
+        if colors < 256:
+            frame = frame.quantize(colors, method=Image.FASTOCTREE, dither=Image.NONE).convert("RGBA")
+        kept.append(frame)
+        # A dropped frame's time goes to the frame before it, so the animation keeps its speed
+        kept_durations.append(sum(durations[i:i + step]))
+        kept_disposals.append(disposals[i])
+
+    output = io.BytesIO()
+    kept[0].save(
+        output,
+        format="GIF",
+        save_all=True,
+        append_images=kept[1:],
+        duration=kept_durations,
+        disposal=kept_disposals,
+        loop=loop,
+    )
+    return output.getvalue()
+
+
+def render_png(image, size, colors=None):
+    """Encode a still image as a PNG fitting in ``size``, optionally with a reduced palette."""
+    image = image.convert("RGBA")
+    image.thumbnail(size, Image.LANCZOS)
+    if colors is not None:
+        image = image.quantize(colors, method=Image.FASTOCTREE)
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def largest_fitting(render, max_side, budget):
+    """Binary search for the largest side length whose rendering fits in ``budget`` bytes.
+
+    Returns ``(side, data)``, or ``(0, None)`` if even the smallest size is too big.
+    """
+    # Most images fit at full size once re-encoded, so check that before searching
+    data = render((max_side, max_side))
+    if len(data) <= budget:
+        return max_side, data
+    low, high = min(MIN_SIZE, max_side), max_side - 1
+    best = (0, None)
+    while low <= high:
+        side = (low + high) // 2
+        data = render((side, side))
+        if len(data) <= budget:
+            best = (side, data)
+            low = side + 1
+        else:
+            high = side - 1
+    return best
+
+
+def encode_emoji(image_data, budget=EMOJI_BYTE_LIMIT, max_side=EMOJI_SIZE):
+    """Return the best quality encoding of an image that fits in ``budget`` bytes.
+
+    Each option, from best to worst quality, is binary searched for the largest resolution
+    that fits, and the first one reaching ``MIN_GOOD_SIZE`` wins. If none does, the largest
+    fitting candidate is used. Animations always come out as GIFs and stills as PNGs.
+    """
+    with Image.open(io.BytesIO(image_data)) as image:
+        max_side = min(max_side, max(image.size))
+        if getattr(image, "is_animated", False):
+            loop = image.info.get("loop", 0)
+            frames, durations, disposals = load_frames(image)
+            renderers = [
+                lambda size, colors=colors, step=step: render_gif(frames, durations, disposals, loop, size, colors, step)
+                for colors, step in ANIMATED_OPTIONS
+            ]
+        else:
+            image.load()
+            renderers = [lambda size, colors=colors: render_png(image, size, colors) for colors in STATIC_OPTIONS]
+
+        best = (0, None)
+        for render in renderers:
+            side, data = largest_fitting(render, max_side, budget)
+            if side >= min(MIN_GOOD_SIZE, max_side):
+                return data
+            if side > best[0]:
+                best = (side, data)
+
+    if best[1] is None:
+        raise ValueError("the image can't be made small enough to fit Discord's emoji size limit")
+    return best[1]
@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import json
+import logging
+import time
+
+log = logging.getLogger("red.treachery.requestemoji.pending")
+
+
+class RequestQueue:
+    """Open emoji requests keyed by the ID of the message announcing them.
+
+    Requests are saved to ``<directory>/requests.json`` shortly after they change and each
+    request's image is kept as ``<directory>/images/<message ID>``, so open requests survive
+    a restart. A single task expires requests in deadline order from a heap and hands each
+    one to ``on_expire``, a coroutine taking the message ID and the request.
+    """
+
+    def __init__(self, directory, on_expire, save_delay=5):
+        self.directory = directory
+        self.on_expire = on_expire
+        self.save_delay = save_delay
+        self._requests = {}
+        self._deadlines = []
+        self._wakeup = asyncio.Event()
+        self._save_task = None
+        self._expire_task = None
+
+    def __len__(self):
+        return len(self._requests)
+
+    def get(self, message_id):
+        return self._requests.get(message_id)
+
+    async def add(self, message_id, request, image_data):
+        """Store a request, which must have an ``expires_at`` timestamp, and its image."""
+        await asyncio.get_running_loop().run_in_executor(None, self._write_image, message_id, image_data)
+        self._requests[message_id] = request
+        self._push(message_id, request["expires_at"])
+        self._schedule_save()
+
+    def pop(self, message_id):
+        """Remove and return a request, or ``None`` if it is already resolved or expired.
+
+        Removing the request claims it, so a second reaction arriving while the first is
+        still being handled finds nothing to act on.
+        """
+        request = self._requests.pop(message_id, None)
+        if request is not None:
+            self._schedule_save()
+        return request
+
+    async def remove_requester(self, user_id):
+        for message_id in [m for m, r in self._requests.items() if r["requester_id"] == user_id]:
+            self.pop(message_id)
+            await self.discard_image(message_id)
+
+    async def image(self, message_id):
+        return await asyncio.get_running_loop().run_in_executor(None, self._read_image, message_id)
+
+    async def discard_image(self, message_id):
+        await asyncio.get_running_loop().run_in_executor(None, self._delete_image, message_id)
+
+    async def load(self):
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError):
+            log.warning("Ignoring unreadable request queue at %s", self._path, exc_info=True)
+            data = {}
+        self._requests = {int(message_id): request for message_id, request in data.items()}
+        self._deadlines = [(request["expires_at"], message_id) for message_id, request in self._requests.items()]
+        heapq.heapify(self._deadlines)
+        await asyncio.get_running_loop().run_in_executor(None, self._prune_images, set(self._requests))
+
+    def start(self):
+        self._expire_task = asyncio.create_task(self._expire_loop())
+
+    async def close(self):
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+            await self.save()
+
+    async def save(self):
+        data = {str(message_id): request for message_id, request in self._requests.items()}
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+    def _push(self, message_id, expires_at):
+        heapq.heappush(self._deadlines, (expires_at, message_id))
+        if self._deadlines[0][1] == message_id:
+            # The new request is due before whatever the expiry task is sleeping on
+            self._wakeup.set()
+
+    async def _expire_loop(self):
+        while True:
+            self._wakeup.clear()
+            while self._deadlines and self._deadlines[0][0] <= time.time():
+                expires_at, message_id = heapq.heappop(self._deadlines)
+                request = self._requests.get(message_id)
+                # Resolved requests leave their deadline behind in the heap; skip those
+                if request is None or request["expires_at"] != expires_at:
+                    continue
+                self.pop(message_id)
+                try:
+                    await self.on_expire(message_id, request)
+                except Exception:
+                    log.exception("Failed to expire emoji request %s", message_id)
+            timeout = self._deadlines[0][0] - time.time() if self._deadlines else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _schedule_save(self):
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        try:
+            await self.save()
+        except OSError:
+            log.exception("Failed to save the emoji request queue")
+
+    @property
+    def _path(self):
+        return self.directory / "requests.json"
+
+    def _image_path(self, message_id):
+        return self.directory / "images" / str(message_id)
+
+    def _read(self):
+        with open(self._path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, data):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        tmp.replace(self._path)
+
+    def _read_image(self, message_id):
+        with open(self._image_path(message_id), "rb") as f:
+            return f.read()
+
+    def _write_image(self, message_id, data):
+        path = self._image_path(message_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def _delete_image(self, message_id):
+        try:
+            self._image_path(message_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _prune_images(self, live):
+        # Images of requests made just before a shutdown that never made it into a save
+        directory = self.directory / "images"
+        if not directory.is_dir():
+            return
+        for path in directory.iterdir():
+            if not path.name.isdigit() or int(path.name) not in live:
+                try:
+                    path.unlink()
+                except OSError:
+                    log.warning("Couldn't remove stale request image %s", path, exc_info=True)
@@ -0,0 +1,167 @@
+import asyncio
+import io
+import json
+import logging
+
+import discord
+from PIL import Image
+
+log = logging.getLogger("red.treachery.requestemoji.phash")
+
+# Matches further apart than this are different images that happen to look alike
+MATCH_RADIUS = 7
+
+
+def dhash(data, size=8):
+    """Return a 64-bit difference hash of an image's first frame.
+
+    Transparent areas are flattened onto white first, since most emojis are cut out and
+    whatever colour sits under their transparent pixels is arbitrary.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGBA")
+    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    pixels = list(Image.alpha_composite(background, image).convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+if hasattr(int, "bit_count"):
+    def hamming(a, b):
+        return (a ^ b).bit_count()
+else:
+    # int.bit_count only exists on Python 3.10+
+    def hamming(a, b):
+        return bin(a ^ b).count("1")
+
+
+class MultiIndex:
+    """Near-duplicate lookup for 64-bit hashes by multi-index hashing.
+
+    Every hash is split into eight 8-bit chunks, with one table per chunk position. Two
+    hashes within Hamming distance 7 must agree exactly on at least one chunk, so a search
+    only compares the query against entries that share a chunk with it rather than all of them.
+    """
+
+    CHUNKS = 8
+    MAX_RADIUS = CHUNKS - 1
+
+    def __init__(self):
+        self.entries = []
+        self.tables = [{} for _ in range(self.CHUNKS)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, value, item):
+        position = len(self.entries)
+        self.entries.append((value, item))
+        for i, table in enumerate(self.tables):
+            table.setdefault((value >> (8 * i)) & 0xFF, []).append(position)
+
+    def search(self, value, radius):
+        """Return ``(distance, item)`` for every entry within ``radius``, closest first."""
+        radius = min(radius, self.MAX_RADIUS)
+        seen = set()
+        found = []
+        for i, table in enumerate(self.tables):
+            for position in table.get((value >> (8 * i)) & 0xFF, ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+                other, item = self.entries[position]
+                distance = hamming(value, other)
+                if distance <= radius:
+                    found.append((distance, item))
+        found.sort(key=lambda entry: entry[0])
+        return found
+
+
+class EmojiIndex:
+    """Hashes of every guild's custom emojis, for spotting requests the guild already has.
+
+    Hashes are kept per guild by emoji ID and saved to ``path``. An emoji's image never
+    changes under the same ID, so a sync only downloads and hashes emojis it hasn't seen,
+    then rebuilds that guild's lookup table from the stored hashes.
+    """
+
+    def __init__(self, path, executor):
+        self.path = path
+        self.executor = executor
+        self._hashes = {}
+        self._tables = {}
+        self._locks = {}
+
+    async def load(self):
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            log.warning("Ignoring unreadable emoji hashes at %s", self.path, exc_info=True)
+            return
+        self._hashes = {
+            int(guild_id): {int(emoji_id): int(value, 16) for emoji_id, value in emojis.items()}
+            for guild_id, emojis in data.items()
+        }
+
+    async def sync(self, guild, emojis=None):
+        """Bring a guild's table in line with ``emojis``, defaulting to its current emojis."""
+        emojis = guild.emojis if emojis is None else emojis
+        loop = asyncio.get_running_loop()
+        async with self._locks.setdefault(guild.id, asyncio.Lock()):
+            known = self._hashes.get(guild.id, {})
+            hashes = {emoji.id: known[emoji.id] for emoji in emojis if emoji.id in known}
+            for emoji in emojis:
+                if emoji.id in hashes:
+                    continue
+                try:
+                    data = await emoji.read()
+                    hashes[emoji.id] = await loop.run_in_executor(self.executor, dhash, data)
+                except (discord.HTTPException, OSError, ValueError):
+                    log.warning("Couldn't hash emoji %s in guild %s", emoji.id, guild.id, exc_info=True)
+            table = MultiIndex()
+            for emoji in emojis:
+                if emoji.id in hashes:
+                    table.add(hashes[emoji.id], emoji)
+            changed = hashes != known
+            self._hashes[guild.id] = hashes
+            self._tables[guild.id] = table
+        if changed:
+            await self.save()
+
+    def matches(self, guild, value, radius=MATCH_RADIUS):
+        """Return ``(distance, emoji)`` for the guild's emojis that look like ``value``, closest first.
+
+        A guild whose table hasn't been built yet has no matches; building it means downloading
+        every emoji, which is left to the background sync rather than done on a request.
+        """
+        table = self._tables.get(guild.id)
+        return table.search(value, radius) if table is not None else []
+
+    async def forget(self, guild_id):
+        self._tables.pop(guild_id, None)
+        if self._hashes.pop(guild_id, None) is not None:
+            await self.save()
+
+    async def save(self):
+        data = {
+            str(guild_id): {str(emoji_id): f"{value:016x}" for emoji_id, value in emojis.items()}
+            for guild_id, emojis in self._hashes.items()
+        }
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        tmp.replace(self.path)
@@ -1,20 +1,113 @@
 import discord
 from redbot.core import commands, checks, errors
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.chat_formatting import pagify
 from discord.ext.commands.converter import EmojiConverter
-from PIL import Image, ImageSequence
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
 import io
 import asyncio
-import imghdr
-import subprocess
-import os
+import time
 import aiohttp  # Import aiohttp for handling HTTP requests
 
+from .bulk import MAX_ARCHIVE_BYTES, ArchiveError, BulkApprovalView, prepare_entry, read_archive
+from .download import DownloadError, check_attachment, fetch_image
+from .imaging import EMOJI_BYTE_LIMIT, encode_emoji, plan_encoding
+from .pending import RequestQueue
+from .phash import EmojiIndex, dhash
+from .sniff import sniff
+
+# How many encoded images to remember, so re-requests of the same image are instant
+ENCODE_CACHE_SIZE = 64
+# How many look-alike emojis to list on a request
+SIMILAR_SHOWN = 3
+# Bulk imports encode in separate processes, and upload one emoji at a time this far apart
+IMPORT_WORKERS = 4
+UPLOAD_DELAY = 2
+# Failures listed in an import report before the rest are summed up
+REPORTED_FAILURES = 20
+REQUEST_LIFETIME = 1800
+APPROVE = "\u2705"
+DENY = "\u274c"
+APPROVER_ROLES = ["Officer", "Guild Master"]
+
+
+def is_approver(member):
+    return member.top_role.name in APPROVER_ROLES
+
 class RequestEmoji(commands.Cog):
     """A cog that allows users to request custom emojis."""
 
     def __init__(self, bot):
         self.bot = bot
+        # Image work is CPU bound, so it runs here rather than on the event loop
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="requestemoji")
+        self.encoded = OrderedDict()
+        self.requests = RequestQueue(cog_data_path(self), self.expire_request)
+        self.session = None
+        self.emoji_index = EmojiIndex(cog_data_path(self) / "emoji_hashes.json", self.executor)
+        # Started on the first bulk import, since most bots never run one
+        self.process_pool = None
+        self._ready_task = None
+
+    async def cog_load(self):
+        await self.requests.load()
+        await self.emoji_index.load()
+        self._ready_task = asyncio.create_task(self.start_when_ready())
+
+    async def cog_unload(self):
+        if self._ready_task is not None:
+            self._ready_task.cancel()
+        await self.requests.close()
+        if self.session is not None:
+            await self.session.close()
+        self.executor.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+
+    async def red_delete_data_for_user(self, *, requester, user_id):
+        await self.requests.remove_requester(user_id)
+
+    async def start_when_ready(self):
+        # Cogs load before the gateway connects, when no channel can be resolved yet. Requests
+        # that expired while the bot was offline would lose their notice if expiry ran then.
+        await self.bot.wait_until_red_ready()
+        self.requests.start()
+        for guild in self.bot.guilds:
+            await self.emoji_index.sync(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(self, guild, before, after):
+        await self.emoji_index.sync(guild, after)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        await self.emoji_index.sync(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        await self.emoji_index.forget(guild.id)
+
+    async def similar_emojis(self, guild, image_data):
+        try:
+            value = await asyncio.get_running_loop().run_in_executor(self.executor, dhash, image_data)
+        except (ValueError, OSError):
+            return []
+        return self.emoji_index.matches(guild, value)[:SIMILAR_SHOWN]
+
+    async def encode(self, image_data):
+        """Fit an image into Discord's emoji size limit, memoized by content hash."""
+        key = hashlib.sha256(image_data).digest()
+        if key in self.encoded:
+            self.encoded.move_to_end(key)
+            return self.encoded[key]
+        encoded = await asyncio.get_running_loop().run_in_executor(self.executor, encode_emoji, image_data, EMOJI_BYTE_LIMIT)
+        self.encoded[key] = encoded
+        while len(self.encoded) > ENCODE_CACHE_SIZE:
+            self.encoded.popitem(last=False)
+        return encoded
 
     @commands.command(name="requestemoji", aliases=["reqemoji"], help="Request a custom emoji to be added to the server.", usage="<name> [attachment or URL]")
     @commands.guild_only()
@@ -36,102 +129,195 @@ class RequestEmoji(commands.Cog):
         attachment = ctx.message.attachments[0] if ctx.message.attachments else None
         image_data = None
 
-        if attachment:
-            try:
+        try:
+            if attachment:
+                check_attachment(attachment)
                 image_data = await attachment.read()
-            except Exception as e:
-                await ctx.send("There was an error while reading the image. Please try again with a valid PNG or JPG file.")
-                return
-        elif image_url:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as resp:
-                        if resp.status == 200:
-                            image_data = await resp.read()
-                        else:
-                            await ctx.send("Failed to fetch image from URL.")
-                            return
-            except Exception as e:
-                await ctx.send("There was an error while fetching the image from the URL.")
-                return
+            elif image_url:
+                if self.session is None:
+                    self.session = aiohttp.ClientSession()
+                image_data = await fetch_image(self.session, image_url)
+        except DownloadError as e:
+            await ctx.send(str(e))
+            return
+        except discord.HTTPException:
+            await ctx.send("There was an error while reading the image. Please try again with a valid PNG or JPG file.")
+            return
 
         if not image_data:
             await ctx.send("No valid image found. Please attach an image or provide a valid image URL.")
             return
 
-        if len(image_data) > 256000:
+        # The headers are enough to decide, so nothing is decoded unless it has to be re-encoded
+        try:
+            info = sniff(image_data)
+        except ValueError:
+            info = None
+        action = plan_encoding(info, len(image_data))
+        if action == "reject":
+            await ctx.send("That image isn't a PNG, JPG, GIF or WebP file that can be read, or its dimensions are far too large.")
+            return
+        if action == "encode":
             try:
-                image_data = resize_image_file(image_data, (128, 128))
-            except ValueError as e:
+                image_data = await self.encode(image_data)
+            except (ValueError, OSError) as e:
                 await ctx.send(f"There was an error while resizing the image file: {e}")
                 return
 
         embed = discord.Embed(title=f"Emoji request: {name}", description=f"{ctx.author.mention} has requested a custom emoji with this name and image. An Officer or Guild Master can approve or deny this request by reacting with a checkmark or x emoji.", color=discord.Color.red())
         embed.set_image(url="attachment://emoji.gif")
+        similar = await self.similar_emojis(ctx.guild, image_data)
+        if similar:
+            embed.add_field(name="Looks like existing emojis", value="\n".join(f"{emoji} `:{emoji.name}:`" for _, emoji in similar), inline=False)
         embed.set_footer(text="This request will expire in 30 minutes.")
         file = discord.File(io.BytesIO(image_data), filename="emoji.gif")
         message = await ctx.send(embed=embed, file=file)
 
-        await message.add_reaction("\u2705")
-        await message.add_reaction("\u274c")
-
-        def check(reaction, user):
-            return (reaction.message.id == message.id and user != self.bot.user and user.top_role.name in ["Officer", "Guild Master"] and reaction.emoji in ["\u2705", "\u274c"])
+        request = {
+            "guild_id": ctx.guild.id,
+            "channel_id": ctx.channel.id,
+            "requester_id": ctx.author.id,
+            "name": name,
+            "expires_at": time.time() + REQUEST_LIFETIME,
+        }
+        await self.requests.add(message.id, request, image_data)
+        await message.add_reaction(APPROVE)
+        await message.add_reaction(DENY)
 
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        # Every reaction the bot sees lands here, so anything that isn't a request bails on one dict lookup
+        if self.requests.get(payload.message_id) is None:
+            return
+        emoji = str(payload.emoji)
+        member = payload.member
+        if emoji not in (APPROVE, DENY) or member is None or member.bot or not is_approver(member):
+            return
+        request = self.requests.pop(payload.message_id)
+        if request is None:
+            return
+        channel = self.bot.get_channel(request["channel_id"])
         try:
-            reaction, user = await self.bot.wait_for("reaction_add", timeout=1800.0, check=check)
-        except asyncio.TimeoutError:
-            await ctx.send(f"The emoji request for {name} has expired after 30 minutes.")
+            if channel is None:
+                return
+            requester = f"<@{request['requester_id']}>"
+            if emoji == APPROVE:
+                try:
+                    image_data = await self.requests.image(payload.message_id)
+                    emoji = await member.guild.create_custom_emoji(name=request["name"], image=image_data)
+                    await channel.send(f"The emoji {emoji} was added successfully by {member.mention} for {requester}.")
+                except discord.HTTPException as e:
+                    await handle_emoji_creation_error(e, channel)
+                except OSError:
+                    await channel.send("The image for this request could not be found. Please request the emoji again.")
+            else:
+                await channel.send(f"The emoji request for {request['name']} was denied by {member.mention} for {requester}.")
+        finally:
+            await self.requests.discard_image(payload.message_id)
+
+    @commands.command(name="bulkemoji", help="Import every image in a zip archive as emojis after one review. Officers and Guild Masters only.", usage="<zip attachment>")
+    @commands.guild_only()
+    @commands.check(lambda ctx: is_approver(ctx.author))
+    async def bulk_emoji(self, ctx):
+        attachment = ctx.message.attachments[0] if ctx.message.attachments else None
+        if attachment is None or not attachment.filename.lower().endswith(".zip"):
+            await ctx.send("Please attach a zip archive of the images to import.")
+            return
+        if attachment.size > MAX_ARCHIVE_BYTES:
+            await ctx.send(f"The archive is too large, the limit is {MAX_ARCHIVE_BYTES // (1024 * 1024)} MB.")
             return
 
-        if reaction.emoji == "\u2705":
+        loop = asyncio.get_running_loop()
+        async with ctx.typing():
             try:
-                emoji = await ctx.guild.create_custom_emoji(name=name, image=image_data)
-                await ctx.send(f"The emoji {emoji} was added successfully by {user.mention} for {ctx.author.mention}.")
-            except discord.HTTPException as e:
-                handle_emoji_creation_error(e, ctx)
+                data = await attachment.read()
+                entries, failures = await loop.run_in_executor(self.executor, read_archive, data)
+            except discord.HTTPException:
+                await ctx.send("There was an error while reading the archive. Please try again.")
+                return
+            except ArchiveError as e:
+                await ctx.send(str(e))
+                return
+            if self.process_pool is None:
+                self.process_pool = ProcessPoolExecutor(max_workers=IMPORT_WORKERS)
+            try:
+                results = await asyncio.gather(*(loop.run_in_executor(self.process_pool, prepare_entry, name, image) for name, image in entries))
+            except BrokenProcessPool:
+                self.process_pool = None
+                await ctx.send("The image workers crashed while processing the archive. Please try again.")
+                return
+
+        prepared, similar = [], []
+        for name, image, value, error in results:
+            if error is not None:
+                failures.append((name, error))
+                continue
+            prepared.append((name, image))
+            similar.append([emoji for _, emoji in self.emoji_index.matches(ctx.guild, value)[:SIMILAR_SHOWN]])
+        if not prepared:
+            await self.send_import_report(ctx, [], failures)
+            return
 
-        if reaction.emoji == "\u274c":
-            await ctx.send(f"The emoji request for {name} was denied by {user.mention} for {ctx.author.mention}.")
+        view = BulkApprovalView(ctx, prepared, similar)
+        embed, file = view.page()
+        view.message = await ctx.send(embed=embed, file=file, view=view)
+        await view.wait()
+        if not view.approved:
+            await ctx.send("The bulk import was cancelled. No emojis were added.")
+            return
+        chosen = [entry for entry, included in zip(prepared, view.included) if included]
+        added = await self.upload_emojis(ctx, chosen, failures)
+        await self.send_import_report(ctx, added, failures)
 
-def handle_emoji_creation_error(e, ctx):
+    async def upload_emojis(self, ctx, chosen, failures):
+        """Create emojis one at a time, editing a progress message as they go."""
+        guild = ctx.guild
+        free = {
+            False: guild.emoji_limit - sum(not emoji.animated for emoji in guild.emojis),
+            True: guild.emoji_limit - sum(emoji.animated for emoji in guild.emojis),
+        }
+        progress = await ctx.send(f"Uploading emojis: 0 of {len(chosen)} done.")
+        added = []
+        for done, (name, image) in enumerate(chosen, 1):
+            try:
+                animated = sniff(image).animated
+            except (ValueError, AttributeError):
+                animated = False
+            if free[animated] <= 0:
+                failures.append((name, f"the server has no free {'animated' if animated else 'static'} emoji slots left"))
+            else:
+                try:
+                    added.append(await guild.create_custom_emoji(name=name, image=image, reason=f"Bulk import by {ctx.author}"))
+                    free[animated] -= 1
+                except discord.HTTPException as e:
+                    failures.append((name, e.text or "Discord rejected the upload"))
+                    if e.code == 30008:
+                        free[animated] = 0
+                # discord.py waits out 429s itself, this just keeps a large import from hitting them
+                await asyncio.sleep(UPLOAD_DELAY)
+            await progress.edit(content=f"Uploading emojis: {done} of {len(chosen)} done, {len(added)} added.")
+        return added
+
+    async def send_import_report(self, ctx, added, failures):
+        lines = [f"Added {len(added)} emoji{'s' if len(added) != 1 else ''}: {' '.join(str(emoji) for emoji in added)}" if added else "No emojis were added."]
+        if failures:
+            lines.append(f"{len(failures)} could not be imported:")
+            lines.extend(f"- `{name}`: {reason}" for name, reason in failures[:REPORTED_FAILURES])
+            if len(failures) > REPORTED_FAILURES:
+                lines.append(f"...and {len(failures) - REPORTED_FAILURES} more.")
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    async def expire_request(self, message_id, request):
+        await self.requests.discard_image(message_id)
+        channel = self.bot.get_channel(request["channel_id"])
+        if channel is not None:
+            await channel.send(f"The emoji request for {request['name']} has expired after 30 minutes.")
+
+async def handle_emoji_creation_error(e, channel):
     if e.code == 30008:
-        ctx.send("The server has reached the maximum number of emojis. Please delete some existing emojis before requesting a new one.")
+        await channel.send("The server has reached the maximum number of emojis. Please delete some existing emojis before requesting a new one.")
     elif e.code == 50035:
-        ctx.send("The name or image is invalid. Please try again with a valid name and image.")
-    else:
-        ctx.send(f"There was an error while creating the emoji. Please try again later.")
-
-def resize_image_file(image_data, size):
-    image_format = imghdr.what(None, image_data)
-    if image_format == "gif":
-        return resize_gif(image_data, size)
-    elif image_format in ["png", "jpeg"]:
-        return resize_image(image_data, size)
+        await channel.send("The name or image is invalid. Please try again with a valid name and image.")
     else:
-        raise ValueError(f"Unsupported image format: {image_format}")
-        return None
-
-def resize_gif(image_data, size):
-    temp_file = "temp.gif"
-    with open(temp_file, "wb") as f:
-        f.write(image_data)
-    resized_file = "resized.gif"
-    params = ['convert', '-resize', f'{size[0]}x{size[1]}', temp_file, resized_file]
-    subprocess.check_call(params)
-    with open(resized_file, "rb") as f:
-        resized_image_data = f.read()
-    os.remove(temp_file)
-    os.remove(resized_file)
-    return resized_image_data
-
-def resize_image(image_data, size):
-    image = Image.open(io.BytesIO(image_data))
-    image.thumbnail(size, Image.LANCZOS)
-    image = image.convert("RGBA")
-    output = io.BytesIO()
-    image.save(output, format="PNG")
-    output.seek(0)
-    resized_image_data = output.read()
-    output.close()
-    return resized_image_data
+        await channel.send(f"There was an error while creating the emoji. Please try again later.")
@@ -0,0 +1,163 @@
+"""Read an image's format, size and frame count from its container headers alone.
+
+Nothing here decodes pixel data, so probing a large upload costs microseconds rather than a
+full Pillow decode. GIF frame counting has to walk every block in the file, but it only
+reads block lengths and skips over the compressed data.
+"""
+import struct
+from collections import namedtuple
+
+ImageInfo = namedtuple("ImageInfo", "format width height frames animated")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start-of-frame markers carry the dimensions; C4, C8 and CC share the range but aren't frames
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def detect_format(head):
+    """Return the format named by the first 12 bytes of a file, or ``None``."""
+    if head.startswith(PNG_SIGNATURE):
+        return "png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def sniff(data):
+    """Return an ``ImageInfo`` for PNG (including APNG), JPEG, GIF or WebP data.
+
+    Returns ``None`` for any other format, and raises ``ValueError`` if the headers are
+    truncated or malformed.
+    """
+    image_format = detect_format(data[:12])
+    if image_format is None:
+        return None
+    try:
+        return SNIFFERS[image_format](data)
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"truncated or malformed {image_format} header") from e
+
+
+def _sniff_png(data):
+    if data[12:16] != b"IHDR":
+        raise ValueError("PNG doesn't start with an IHDR chunk")
+    width, height = struct.unpack_from(">II", data, 16)
+    # acTL has to come before the first IDAT, so the search can stop there
+    offset = 8
+    while offset + 8 <= len(data):
+        length, chunk = struct.unpack_from(">I4s", data, offset)
+        if chunk == b"acTL":
+            frames = struct.unpack_from(">I", data, offset + 8)[0]
+            return ImageInfo("png", width, height, frames, frames > 1)
+        if chunk in (b"IDAT", b"IEND"):
+            break
+        offset += 12 + length
+    return ImageInfo("png", width, height, 1, False)
+
+
+def _sniff_jpeg(data):
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError("expected a JPEG marker")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            break
+        length = struct.unpack_from(">H", data, offset + 2)[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return ImageInfo("jpeg", width, height, 1, False)
+        offset += 2 + length
+    raise ValueError("no JPEG start-of-frame marker before the image data")
+
+
+def _skip_sub_blocks(data, offset):
+    while True:
+        size = data[offset]
+        offset += 1 + size
+        if size == 0:
+            return offset
+
+
+def _sniff_gif(data):
+    width, height, flags = struct.unpack_from("<HHB", data, 6)
+    offset = 13
+    if flags & 0x80:
+        offset += 3 << ((flags & 0x07) + 1)
+    frames = 0
+    while offset < len(data):
+        block = data[offset]
+        if block == 0x3B:
+            break
+        if block == 0x21:
+            offset = _skip_sub_blocks(data, offset + 2)
+        elif block == 0x2C:
+            frames += 1
+            local_flags = data[offset + 9]
+            offset += 10
+            if local_flags & 0x80:
+                offset += 3 << ((local_flags & 0x07) + 1)
+            # One byte of LZW minimum code size, then the compressed frame
+            offset = _skip_sub_blocks(data, offset + 1)
+        elif frames:
+            # Padding or junk where the trailer should be; decoders stop here too
+            break
+        else:
+            raise ValueError(f"unknown GIF block 0x{block:02x}")
+    frames = max(frames, 1)
+    return ImageInfo("gif", width, height, frames, frames > 1)
+
+
+def _sniff_webp(data):
+    offset = 12
+    width = height = None
+    animated = False
+    frames = 0
+    while offset + 8 <= len(data):
+        chunk, length = struct.unpack_from("<4sI", data, offset)
+        body = offset + 8
+        if chunk == b"VP8X":
+            animated = bool(data[body] & 0x02)
+            width = 1 + int.from_bytes(data[body + 4:body + 7], "little")
+            height = 1 + int.from_bytes(data[body + 7:body + 10], "little")
+            if not animated:
+                break
+        elif chunk == b"ANMF":
+            frames += 1
+        elif chunk == b"VP8 " and width is None:
+            if data[body + 3:body + 6] != b"\x9d\x01\x2a":
+                raise ValueError("missing VP8 start code")
+            width, height = struct.unpack_from("<HH", data, body + 6)
+            width, height = width & 0x3FFF, height & 0x3FFF
+            break
+        elif chunk == b"VP8L" and width is None:
+            if data[body] != 0x2F:
+                raise ValueError("missing VP8L signature")
+            bits = int.from_bytes(data[body + 1:body + 5], "little")
+            width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            break
+        # Chunks are padded to an even length
+        offset = body + length + (length & 1)
+    if width is None:
+        raise ValueError("no WebP image chunk")
+    frames = max(frames, 1)
+    return ImageInfo("webp", width, height, frames, animated and frames > 1)
+
+
+SNIFFERS = {
+    "png": _sniff_png,
+    "jpeg": _sniff_jpeg,
+    "gif": _sniff_gif,
+    "webp": _sniff_webp,
+}
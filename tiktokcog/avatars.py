@@ -0,0 +1,115 @@
+import asyncio
+import io
+import logging
+import os
+from collections import OrderedDict
+
+import aiohttp
+from PIL import Image, ImageDraw
+
+log = logging.getLogger("red.treachery.tiktokcog.avatars")
+
+AVATAR_SIZE = 128
+
+
+def process_avatar(data):
+    """Crop raw avatar bytes to a 128x128 circle and return them as PNG bytes."""
+    image = Image.open(io.BytesIO(data)).convert("RGBA").resize((AVATAR_SIZE, AVATAR_SIZE))
+    mask = Image.new("L", image.size)
+    ImageDraw.Draw(mask).ellipse([0, 0, *image.size], fill=255)
+    output = io.BytesIO()
+    Image.composite(image, Image.new("RGBA", image.size), mask).save(output, format="PNG")
+    return output.getvalue()
+
+
+class AvatarCache:
+    """Processed circular avatars keyed by Discord's avatar hash.
+
+    Lookups go through an in-memory LRU, then a directory of PNGs on disk, and only then
+    download the avatar with a shared session and process it in an executor. Since the hash
+    changes whenever someone changes their avatar, cached entries never go stale; both tiers
+    just evict their least recently used entries once they are full.
+    """
+
+    def __init__(self, directory, memory_size=128, disk_size=2048):
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._disk_count = None
+        self._session = None
+
+    async def get(self, asset):
+        """Return processed PNG bytes for a ``discord.Asset``."""
+        key = asset.key
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if key not in self._inflight:
+            self._inflight[key] = asyncio.ensure_future(self._load(key, asset))
+        try:
+            return await asyncio.shield(self._inflight[key])
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load(self, key, asset):
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self._read_disk, key)
+        if data is None:
+            raw = await self._download(asset.with_size(AVATAR_SIZE).with_static_format("png").url)
+            data = await loop.run_in_executor(None, process_avatar, raw)
+            await loop.run_in_executor(None, self._write_disk, key, data)
+        self._memory[key] = data
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+        return data
+
+    async def _download(self, url):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    def _path(self, key):
+        return self.directory / f"{key}.png"
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Bump the mtime so disk eviction is least recently used rather than oldest written.
+        os.utime(path)
+        return data
+
+    def _write_disk(self, key, data):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self._disk_count is None:
+            self._disk_count = sum(1 for _ in self.directory.glob("*.png"))
+        tmp = self._path(key).with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        tmp.replace(self._path(key))
+        self._disk_count += 1
+        if self._disk_count > self.disk_size:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        files = sorted(self.directory.glob("*.png"), key=lambda path: path.stat().st_mtime)
+        # Trim to 90% so eviction runs every few hundred writes rather than on every one.
+        excess = len(files) - int(self.disk_size * 0.9)
+        for path in files[:max(excess, 0)]:
+            try:
+                path.unlink()
+            except OSError:
+                log.warning("Couldn't evict cached avatar %s", path, exc_info=True)
+        self._disk_count = len(files) - max(excess, 0)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
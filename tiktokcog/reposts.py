@@ -0,0 +1,76 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+
+log = logging.getLogger("red.treachery.tiktokcog.reposts")
+
+
+class RepostIndex:
+    """Maps repost message IDs to the ID of the user whose link was reposted.
+
+    Holds at most ``max_size`` entries, dropping the oldest reposts first, and is saved to
+    ``path`` a short while after it changes so a burst of reposts costs one write.
+    """
+
+    def __init__(self, path, max_size=20000, save_delay=30):
+        self.path = path
+        self.max_size = max_size
+        self.save_delay = save_delay
+        self._entries = OrderedDict()
+        self._save_task = None
+
+    def get(self, message_id):
+        return self._entries.get(message_id)
+
+    def add(self, message_id, author_id):
+        self._entries[message_id] = author_id
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._schedule_save()
+
+    def remove_author(self, author_id):
+        for message_id in [m for m, a in self._entries.items() if a == author_id]:
+            del self._entries[message_id]
+        self._schedule_save()
+
+    async def load(self):
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            log.warning("Ignoring unreadable repost index at %s", self.path, exc_info=True)
+            return
+        self._entries = OrderedDict((int(message_id), author_id) for message_id, author_id in data)
+
+    async def save(self):
+        data = list(self._entries.items())
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+    async def close(self):
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+            await self.save()
+
+    def _schedule_save(self):
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        try:
+            await self.save()
+        except OSError:
+            log.exception("Failed to save the repost index")
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        tmp.replace(self.path)
@@ -0,0 +1,79 @@
+import re
+
+DEFAULT_RULES = [
+    {"source": "tiktok.com", "target": "tnktok.com", "paths": [], "enabled": False},
+    {"source": "twitter.com", "target": "vxtwitter.com", "paths": [], "enabled": True},
+    {"source": "x.com", "target": "fixvx.com", "paths": [], "enabled": True},
+    {"source": "instagram.com", "target": "ddinstagram.com", "paths": ["reel/"], "enabled": True},
+]
+
+
+class LinkRewriter:
+    """Rewrites every supported link in a message in a single regex pass.
+
+    ``rules`` is a list of dicts with a ``source`` host, a ``target`` host, a list of
+    ``paths`` and an ``enabled`` flag. A link is rewritten by the first enabled rule whose
+    source is its host (ignoring subdomains) and, if the rule has any paths, whose path
+    starts with one of them. Adding a platform is just another rule.
+    """
+
+    def __init__(self, rules):
+        self.rules = {}
+        for rule in rules:
+            if rule["enabled"]:
+                prefixes = tuple(path.lower() for path in rule["paths"])
+                self.rules.setdefault(rule["source"].lower(), []).append((rule["target"], prefixes))
+        hosts = "|".join(re.escape(host) for host in sorted(self.rules, key=len, reverse=True))
+        # A link has to start the message or follow whitespace or "<", so a supported host
+        # inside another URL ("evil.com/x.com/a", "?u=x.com/a") or a longer host ("fox.com",
+        # an already rewritten "fixvx.com") is never picked up.
+        self.pattern = re.compile(
+            rf"(?<![^\s<])(?:https?://)?(?:[\w-]+\.)*?(?P<host>{hosts})/(?P<path>[^\s<>]*)",
+            re.IGNORECASE,
+        ) if hosts else None
+
+    def _target(self, match):
+        path = match["path"]
+        for target, prefixes in self.rules[match["host"].lower()]:
+            if not prefixes or path.lower().startswith(prefixes):
+                return f"https://{target}/{path}"
+        return None
+
+    def rewrite(self, content):
+        """Return the rewritten links found in ``content``, in the order they appear."""
+        if self.pattern is None:
+            return []
+        return [link for link in map(self._target, self.pattern.finditer(content)) if link]
+
+    def strip(self, content):
+        """Return ``content`` with every rewritten link removed."""
+        if self.pattern is None:
+            return content
+        return self.pattern.sub(lambda match: "" if self._target(match) else match[0], content)
+
+
+class RewriterCache:
+    """Compiled rewriters per guild, rebuilt only when a guild's rules change.
+
+    Guilds with identical rules share one compiled rewriter, so the number of patterns held
+    grows with the number of distinct rule sets rather than the number of guilds.
+    """
+
+    def __init__(self):
+        self._guilds = {}
+        self._compiled = {}
+
+    def get(self, guild_id):
+        return self._guilds.get(guild_id)
+
+    def set(self, guild_id, rules):
+        key = tuple((r["source"], r["target"], tuple(r["paths"]), r["enabled"]) for r in rules)
+        if key not in self._compiled:
+            self._compiled[key] = LinkRewriter(rules)
+        self._guilds[guild_id] = self._compiled[key]
+        return self._compiled[key]
+
+    def invalidate(self, guild_id):
+        self._guilds.pop(guild_id, None)
+        live = {id(rewriter) for rewriter in self._guilds.values()}
+        self._compiled = {key: rewriter for key, rewriter in self._compiled.items() if id(rewriter) in live}
@@ -1,103 +1,252 @@
-import os
+import asyncio
 import random
 import re
-import requests
-from PIL import Image, ImageDraw
-from redbot.core import commands
+from redbot.core import commands, Config
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box
 import discord
 
+from .avatars import AvatarCache
+from .reposts import RepostIndex
+from .rewrite import DEFAULT_RULES, RewriterCache
+from .workqueue import RepostQueue, RouteLimiter
+
+WEBHOOK_NAME = "TikTokCog"
+HOST_RE = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)+$")
+# Discord refuses webhook usernames containing these words
+RESERVED_NAME_RE = re.compile(r"discord|clyde", re.IGNORECASE)
+
 class TikTokCog(commands.Cog):
     """A custom cog that reposts tiktok, x, and twitter urls"""
 
     def __init__(self, bot):
         self.bot = bot
-        self.url_patterns = {
-            #'tiktok': re.compile(r"(https?://)?((\w+\.)?(\w+)\.)?tiktok.com/(\S*)"),
-            'twitter': re.compile(r"(https?://)?((\w+\.)?(\w+)\.)?twitter.com/(\S*)"),
-            'x': re.compile(r"(https?://)?((\w+\.)?(\w+)\.)?x.com/(\S*)"),
-            'instagram': re.compile(r"(https?://)?((\w+\.)?(\w+)\.)?instagram.com/reel/(\S*)")
-        }
-        self.new_domains = {
-            #'tiktok': 'tnktok.com/',
-            'twitter': 'vxtwitter.com/',
-            'x': 'fixvx.com/',
-            'instagram': 'ddinstagram.com/reel/'
-        }
+        self.rewriters = RewriterCache()
+        self.avatars = AvatarCache(cog_data_path(self) / "avatars")
+        self.reposts = RepostIndex(cog_data_path(self) / "reposts.json")
+        self.config = Config.get_conf(self, identifier=4015283996, force_registration=True)
+        self.config.register_guild(repost_mode="webhook", rules=DEFAULT_RULES)
+        self.webhooks = {}
+        self._webhook_locks = {}
+        self.limiter = RouteLimiter()
+        self.queue = RepostQueue(self.process_repost)
+
+    async def cog_load(self):
+        await self.reposts.load()
+
+    async def cog_unload(self):
+        self.queue.close()
+        await self.avatars.close()
+        await self.reposts.close()
 
     @commands.Cog.listener()
     async def on_message(self, message):
         """A listener that triggers when a message is sent"""
-        if message.author.bot:
+        if message.author.bot or message.guild is None:
             return
 
         if message.reference:
             await self.handle_reply(message)
             return
 
-        for platform, pattern in self.url_patterns.items():
-            if (url_match := pattern.search(message.content)):
-                new_url, memo_text = self.process_message_content(message.content, url_match, platform)
-                avatar_path = self.download_and_process_avatar(message.author.avatar.url)
-                await self.repost_message(message, new_url, memo_text, avatar_path)
-
-    def process_message_content(self, content, url_match, platform):
-        new_url = self.construct_new_url(url_match, platform)
-        memo_text = self.extract_memo_text(content)
-        return new_url, memo_text
-
-    def construct_new_url(self, url_match, platform):
-        if platform == 'instagram' and 'reel' in url_match.group(5):
-            return url_match.group(0).replace('instagram.com', 'ddinstagram.com')
-        else:
-            return (url_match.group(1) or 'https://') + (url_match.group(2) or '') + self.new_domains[platform] + url_match.group(5)
-
-    def extract_memo_text(self, content):
+        rewriter = self.rewriters.get(message.guild.id) or await self.get_rewriter(message.guild)
+        new_urls = rewriter.rewrite(message.content)
+        if new_urls:
+            self.queue.submit(message, new_urls, self.extract_memo_text(message.content, rewriter))
+
+    async def process_repost(self, job):
+        """Repost a queued job, then delete every message that was folded into it."""
+        message = job.message
+        new_url, memo_text = "\n".join(job.urls), "\n".join(job.memos)
+        reposted = False
+        if await self.config.guild(message.guild).repost_mode() == "webhook" and self.can_use_webhooks(message.channel):
+            try:
+                await self.repost_via_webhook(message, new_url, memo_text)
+                reposted = True
+            except discord.HTTPException as e:
+                # A name Discord won't take for a webhook; the emoji repost doesn't need one
+                if e.status != 400:
+                    raise
+        if not reposted:
+            avatar = await self.avatars.get(message.author.display_avatar)
+            await self.repost_message(message, new_url, memo_text, avatar)
+        for original in job.messages:
+            await self.limiter.acquire("delete", original.channel.id)
+            try:
+                await original.delete()
+            except discord.NotFound:
+                pass
+
+    async def get_rewriter(self, guild):
+        """Compile and cache a guild's rewrite rules."""
+        return self.rewriters.set(guild.id, await self.config.guild(guild).rules())
+
+    def extract_memo_text(self, content, rewriter):
+        content = rewriter.strip(content)
         return " ".join([part for part in content.split() if not part.lower().startswith(("https://", "http://"))])
 
-    def download_and_process_avatar(self, avatar_url):
-        avatar_path = "avatar.png"
-        self.download_image(avatar_url, avatar_path)
-        self.process_avatar(avatar_path)
-        return avatar_path
-
-    def download_image(self, url, path):
-        response = requests.get(url)
-        with open(path, "wb") as file:
-            file.write(response.content)
-
-    def process_avatar(self, path):
-        image = Image.open(path).resize((128, 128))
-        mask = Image.new("RGBA", image.size)
-        ImageDraw.Draw(mask).ellipse([0, 0, *image.size], fill=(0, 0, 0, 255))
-        Image.composite(image, Image.new("RGBA", image.size), mask).save(path)
-
-    async def repost_message(self, message, new_url, memo_text, avatar_path):
-        emoji = await self.create_custom_emoji(message.guild, avatar_path)
+    async def repost_message(self, message, new_url, memo_text, avatar):
+        emoji = await self.create_custom_emoji(message.guild, avatar)
         formatted_message = self.format_message(message.author, emoji, new_url, memo_text)
-        await message.channel.send(formatted_message)
-        await message.delete()
+        await self.limiter.acquire("send", message.channel.id)
+        repost = await message.channel.send(formatted_message)
+        self.reposts.add(repost.id, message.author.id)
         await emoji.delete()
-        os.remove(avatar_path)
 
-    async def create_custom_emoji(self, guild, avatar_path):
+    def can_use_webhooks(self, channel):
+        parent = channel.parent if isinstance(channel, discord.Thread) else channel
+        return isinstance(parent, discord.TextChannel) and parent.permissions_for(channel.guild.me).manage_webhooks
+
+    async def get_webhook(self, channel):
+        """Return this cog's webhook for a channel, creating it the first time it's needed."""
+        if channel.id in self.webhooks:
+            return self.webhooks[channel.id]
+        lock = self._webhook_locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            if channel.id not in self.webhooks:
+                webhook = discord.utils.find(lambda w: w.user == self.bot.user and w.name == WEBHOOK_NAME, await channel.webhooks())
+                self.webhooks[channel.id] = webhook or await channel.create_webhook(name=WEBHOOK_NAME)
+        return self.webhooks[channel.id]
+
+    async def repost_via_webhook(self, message, new_url, memo_text):
+        """Repost under the author's name and avatar, which needs only a single send."""
+        channel = message.channel.parent if isinstance(message.channel, discord.Thread) else message.channel
+        kwargs = {"thread": message.channel} if isinstance(message.channel, discord.Thread) else {}
+        content = f"Shared By: {message.author.mention}\n{new_url}\n{memo_text}"
+        for attempt in range(2):
+            webhook = await self.get_webhook(channel)
+            await self.limiter.acquire("send", message.channel.id)
+            try:
+                repost = await webhook.send(
+                    content,
+                    username=webhook_username(message.author.display_name),
+                    avatar_url=message.author.display_avatar.url,
+                    allowed_mentions=discord.AllowedMentions.none(),
+                    wait=True,
+                    **kwargs,
+                )
+                break
+            except discord.NotFound:
+                # Someone deleted the webhook, so forget it and make a new one.
+                self.webhooks.pop(channel.id, None)
+                if attempt:
+                    raise
+        self.reposts.add(repost.id, message.author.id)
+
+    async def create_custom_emoji(self, guild, avatar):
         emoji_name = f"user_avatar_{random.randint(0, 9999)}"
-        with open(avatar_path, "rb") as image:
-            return await guild.create_custom_emoji(name=emoji_name, image=image.read())
+        return await guild.create_custom_emoji(name=emoji_name, image=avatar)
 
     def format_message(self, author, emoji, new_url, memo_text):
         return f"{emoji} Shared By: {author.mention}\n{new_url}\n{memo_text}"
 
     async def handle_reply(self, reply):
-        referenced_message = await reply.channel.fetch_message(reply.reference.message_id)
-        if referenced_message.author == self.bot.user:
-            original_poster = self.extract_original_poster(referenced_message.content)
-            if original_poster:
-                replier_name = reply.author.display_name
-                await reply.channel.send(f"{original_poster.mention}, {replier_name} has replied to your reposted message.")
-
-    def extract_original_poster(self, content):
-        match = re.search(r'Shared By: <@!?(\d+)>', content)
-        if match:
-            user_id = int(match.group(1))
-            return self.bot.get_user(user_id)
-        return None
\ No newline at end of file
+        original_poster_id = self.reposts.get(reply.reference.message_id)
+        if original_poster_id is None or original_poster_id == reply.author.id:
+            return
+        original_poster = reply.guild.get_member(original_poster_id) or self.bot.get_user(original_poster_id)
+        if original_poster:
+            replier_name = reply.author.display_name
+            await reply.channel.send(f"{original_poster.mention}, {replier_name} has replied to your reposted message.")
+
+    async def red_delete_data_for_user(self, *, requester, user_id):
+        self.reposts.remove_author(user_id)
+
+    @commands.group(name="tiktokset")
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def tiktokset(self, ctx):
+        """Configure how TikTokCog reposts links."""
+
+    @tiktokset.command(name="mode")
+    async def tiktokset_mode(self, ctx, mode: str):
+        """Choose between `webhook` and `emoji` reposts.
+
+        Webhook reposts show the author's name and avatar and need the Manage Webhooks permission.
+        Emoji reposts upload the author's avatar as a temporary custom emoji instead.
+        """
+        mode = mode.lower()
+        if mode not in ("webhook", "emoji"):
+            return await ctx.send("The mode must be either `webhook` or `emoji`.")
+        await self.config.guild(ctx.guild).repost_mode.set(mode)
+        await ctx.send(f"Links will now be reposted using {mode} mode.")
+
+    @tiktokset.command(name="stats")
+    @commands.is_owner()
+    async def tiktokset_stats(self, ctx):
+        """Show the repost queue's depth and processing latency."""
+        stats = self.queue.stats()
+        await ctx.send(box(
+            f"Queued reposts  {stats['depth']} across {stats['busy_channels']} channels\n"
+            f"Processed       {stats['processed']} ({stats['coalesced']} messages coalesced, {stats['failed']} failed)\n"
+            f"Latency p50     {stats['p50']:.2f}s\n"
+            f"Latency p95     {stats['p95']:.2f}s\n"
+            f"Latency max     {stats['max']:.2f}s"
+        ))
+
+    @tiktokset.group(name="rules", invoke_without_command=True)
+    async def tiktokset_rules(self, ctx):
+        """List this server's link rewrite rules."""
+        rules = await self.config.guild(ctx.guild).rules()
+        if not rules:
+            return await ctx.send("There are no link rewrite rules.")
+        lines = []
+        for i, rule in enumerate(rules, 1):
+            paths = f" (paths: {', '.join(rule['paths'])})" if rule["paths"] else ""
+            state = "" if rule["enabled"] else " [disabled]"
+            lines.append(f"{i}. {rule['source']} -> {rule['target']}{paths}{state}")
+        await ctx.send(box("\n".join(lines)))
+
+    @tiktokset_rules.command(name="add")
+    async def tiktokset_rules_add(self, ctx, source: str, target: str, *paths: str):
+        """Add a rule rewriting links from one host to another.
+
+        Optionally give path prefixes, and only links whose path starts with one of them are rewritten.
+
+        Example:
+        - `[p]tiktokset rules add tiktok.com tnktok.com`
+        - `[p]tiktokset rules add instagram.com ddinstagram.com reel/`
+        """
+        source, target = normalize_host(source), normalize_host(target)
+        if not HOST_RE.match(source) or not HOST_RE.match(target):
+            return await ctx.send("Please give the source and target as plain host names, like `x.com`.")
+        async with self.config.guild(ctx.guild).rules() as rules:
+            rules.append({"source": source, "target": target, "paths": [path.lstrip("/") for path in paths], "enabled": True})
+        self.rewriters.invalidate(ctx.guild.id)
+        await ctx.send(f"Links to {source} will now be rewritten to {target}.")
+
+    @tiktokset_rules.command(name="remove", aliases=["delete"])
+    async def tiktokset_rules_remove(self, ctx, number: int):
+        """Remove a rule by its number in `[p]tiktokset rules`."""
+        async with self.config.guild(ctx.guild).rules() as rules:
+            if not 1 <= number <= len(rules):
+                return await ctx.send("There is no rule with that number.")
+            rule = rules.pop(number - 1)
+        self.rewriters.invalidate(ctx.guild.id)
+        await ctx.send(f"Removed the rule for {rule['source']}.")
+
+    @tiktokset_rules.command(name="toggle")
+    async def tiktokset_rules_toggle(self, ctx, number: int):
+        """Enable or disable a rule by its number in `[p]tiktokset rules`."""
+        async with self.config.guild(ctx.guild).rules() as rules:
+            if not 1 <= number <= len(rules):
+                return await ctx.send("There is no rule with that number.")
+            rule = rules[number - 1]
+            rule["enabled"] = not rule["enabled"]
+        self.rewriters.invalidate(ctx.guild.id)
+        await ctx.send(f"The rule for {rule['source']} is now {'enabled' if rule['enabled'] else 'disabled'}.")
+
+    @tiktokset_rules.command(name="reset")
+    async def tiktokset_rules_reset(self, ctx):
+        """Restore the default rewrite rules."""
+        await self.config.guild(ctx.guild).rules.clear()
+        self.rewriters.invalidate(ctx.guild.id)
+        await ctx.send("The link rewrite rules have been reset to the defaults.")
+
+def normalize_host(text):
+    text = text.lower().strip().split("://", 1)[-1].split("/", 1)[0]
+    return text[4:] if text.startswith("www.") else text
+
+def webhook_username(name):
+    """Break up words Discord won't allow in a webhook username with a zero-width space."""
+    return RESERVED_NAME_RE.sub(lambda match: f"{match[0][0]}\u200b{match[0][1:]}", name)
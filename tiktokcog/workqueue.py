@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+log = logging.getLogger("red.treachery.tiktokcog.queue")
+
+
+class TokenBucket:
+    """Allows ``capacity`` calls per ``per`` seconds, waiting for a token when empty."""
+
+    def __init__(self, capacity, per):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RouteLimiter:
+    """Token buckets per ``(route, channel ID)``, mirroring Discord's per-channel rate limits."""
+
+    LIMITS = {
+        "send": (5, 5.0),
+        "delete": (5, 5.0),
+    }
+
+    def __init__(self):
+        self._buckets = {}
+
+    async def acquire(self, route, channel_id):
+        key = (route, channel_id)
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(*self.LIMITS[route])
+        await self._buckets[key].acquire()
+
+
+class RepostJob:
+    """One pending repost, possibly merged from several messages by the same author."""
+
+    __slots__ = ("messages", "urls", "memos", "enqueued_at")
+
+    def __init__(self, message, urls, memo_text):
+        self.messages = [message]
+        self.urls = list(urls)
+        self.memos = [memo_text] if memo_text else []
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def message(self):
+        return self.messages[0]
+
+    def merge(self, message, urls, memo_text):
+        self.messages.append(message)
+        self.urls.extend(url for url in urls if url not in self.urls)
+        if memo_text:
+            self.memos.append(memo_text)
+
+
+class RepostQueue:
+    """Per-channel repost queues drained by a bounded pool of workers.
+
+    Each channel is drained in order by at most one worker, and at most ``max_workers``
+    channels are processed at once. A link posted by someone whose previous repost in the
+    same channel hasn't started yet is folded into it, so a burst becomes one repost.
+    """
+
+    def __init__(self, handler, max_workers=4, coalesce_window=3.0, samples=500):
+        self.handler = handler
+        self.coalesce_window = coalesce_window
+        self._slots = asyncio.Semaphore(max_workers)
+        self._queues = {}
+        self._workers = {}
+        self.latencies = deque(maxlen=samples)
+        self.processed = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def submit(self, message, urls, memo_text):
+        queue = self._queues.setdefault(message.channel.id, deque())
+        if queue:
+            last = queue[-1]
+            if last.message.author.id == message.author.id and time.monotonic() - last.enqueued_at <= self.coalesce_window:
+                last.merge(message, urls, memo_text)
+                self.coalesced += 1
+                return
+        queue.append(RepostJob(message, urls, memo_text))
+        if message.channel.id not in self._workers:
+            self._workers[message.channel.id] = asyncio.create_task(self._drain(message.channel.id))
+
+    async def _drain(self, channel_id):
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                async with self._slots:
+                    job = queue.popleft()
+                    try:
+                        await self.handler(job)
+                    except Exception:
+                        self.failed += 1
+                        log.exception("Failed to repost message %s", job.message.id)
+                    else:
+                        self.processed += 1
+                    self.latencies.append(time.monotonic() - job.enqueued_at)
+        finally:
+            del self._workers[channel_id]
+            if not queue:
+                self._queues.pop(channel_id, None)
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        """Return queue depth, throughput counters and latency percentiles in seconds."""
+        ordered = sorted(self.latencies)
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+        return {
+            "depth": self.depth,
+            "busy_channels": len(self._workers),
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": ordered[-1] if ordered else 0.0,
+        }
+
+    def close(self):
+        for task in self._workers.values():
+            task.cancel()